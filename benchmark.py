@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+"""
+BENCHMARK.PY
+
+Benchmarks the crossword engine (crossword.py) over a fixed corpus of word sets, reporting for each search the number
+of nodes expanded and placements checked, nodes per second, the time to the first and to the best grid, peak memory
+and the quality of the grids found. Results are written as JSON, so that runs before and after a change to the engine
+can be compared (see --baseline).
+"""
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+from concurrent.futures import ProcessPoolExecutor
+
+from crossword import (Search, search_grids, greedy_search, TRANSPOSE_SYMMETRY, FORWARD_CHECKING, TIME_LIMIT,
+                       SEARCH_MODES, ENGINES, ENGINE_VERSION)
+
+# Word sets to search, by category.
+CORPUS: Dict[str, List[List[str]]] = {
+    "easy": [
+        ["CAT", "DOG", "TIGER", "GOAT", "RAT"],
+        ["APPLE", "PEAR", "PLUM", "LEMON", "MELON"],
+    ],
+    "typical": [
+        ["AXOLOTL", "BEAR", "CANARY", "DINGO", "ELEPHANT"],
+        ["STREAM", "TEAMS", "MASTER", "ARREST", "SEAT"],
+        ["TEACHER", "CHEETAH", "ARCHER", "THEATRE", "REACH"],
+    ],
+    # Repeated letters give many ways for each pair of words to cross.
+    "adversarial": [
+        ["AAAAAA", "AAAAAA", "AAAAAA", "AAAAAA", "AAAAAA"],
+        ["ABABAB", "BABABA", "AABBAA", "ABBA", "BAAB"],
+    ],
+    "infeasible": [
+        ["CAT", "DOG", "FLY", "HEN", "EMU"],
+        ["QUIZ", "JAZZ", "FIZZ", "BUZZ", "XYLEM"],
+    ],
+    "max_length": [
+        ["COUNTERREVOLUTIONARY", "ELECTROENCEPHALOGRAM", "UNCHARACTERISTICALLY", "OVERINTELLECTUALIZED",
+         "INSTITUTIONALIZATION"],
+    ],
+}
+
+# Fraction by which a timing may get worse than the baseline before it counts as a regression...
+TOLERANCE = 0.2
+# ...as long as it's also worse by at least this many seconds (so that noise in very short searches is ignored).
+MIN_REGRESSION = 0.05
+
+
+def run_case(words: List[str], mode: str, engine: str, strictness: str, time_limit: Optional[float],
+             trace_memory: bool) -> Dict[str, Any]:
+    """
+    Runs a single search and measures it. Intended to be run in a fresh worker process, so that peak memory is measured
+    for this search alone.
+    :return: Record of the search's measurements.
+    """
+    if trace_memory:
+        tracemalloc.start()
+
+    improvements = []
+    start = time.perf_counter()
+    on_improvement = lambda xw: improvements.append(time.perf_counter() - start)
+
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    search = Search(TRANSPOSE_SYMMETRY, deadline=deadline, strictness=strictness, forward_checking=FORWARD_CHECKING)
+    if engine == "greedy":
+        result = greedy_search(words, search, on_improvement)
+    else:
+        result = search_grids(words, mode, search=search, on_improvement=on_improvement)
+    elapsed = time.perf_counter() - start
+
+    record = {
+        "words": words,
+        "mode": mode,
+        "engine": engine,
+        "strictness": strictness,
+        "elapsed": elapsed,
+        "nodes": search.nodes,
+        "checks": search.checks,
+        "nodes_per_sec": search.nodes / elapsed if elapsed > 0 else None,
+        "time_to_first_grid": improvements[0] if improvements else None,
+        "time_to_best_grid": improvements[-1] if improvements else None,
+        # Kilobytes on Linux (bytes on macOS).
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_traced_kib": None,
+        "num_grids": result.num_grids,
+        "best_score": list(result.grids[0].score()) if result.grids else None,
+        "warnings": result.warnings,
+        "partial": result.partial,
+        "infeasible": result.infeasible is not None,
+    }
+    if trace_memory:
+        record["peak_traced_kib"] = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    return record
+
+
+def run_benchmark(modes: List[str], engines: List[str], strictness: str, time_limit: Optional[float], repeat: int,
+                  trace_memory: bool, categories: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Runs every search in the corpus, each in a fresh process. Of repeated runs, the fastest is kept.
+    :return: List of records (see run_case(...)), each with the category of its word set added.
+    """
+    records = []
+    for category, word_sets in CORPUS.items():
+        if categories and category not in categories:
+            continue
+        for words in word_sets:
+            for engine in engines:
+                # The greedy engine has no search modes.
+                for mode in (modes if engine == "exhaustive" else ["best"]):
+                    runs = []
+                    for _ in range(repeat):
+                        with ProcessPoolExecutor(1) as pool:
+                            runs.append(pool.submit(run_case, words, mode, engine, strictness, time_limit,
+                                                    trace_memory).result())
+                    record = min(runs, key=lambda run: run["elapsed"])
+                    record["category"] = category
+                    records.append(record)
+                    print(summary_line(record), file=sys.stderr)
+    return records
+
+
+def case_key(record: Dict[str, Any]) -> str:
+    return f"{','.join(record['words'])}|{record['mode']}|{record['engine']}|{record['strictness']}"
+
+
+def summary_line(record: Dict[str, Any]) -> str:
+    def seconds(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.3f}s"
+
+    rate = "-" if record["nodes_per_sec"] is None else f"{record['nodes_per_sec']:.0f}"
+    return (f"{record['category']:<12} {record['words'][0]:<21} {record['engine']:<10} {record['mode']:<9} "
+            f"{seconds(record['elapsed']):>8} nodes={record['nodes']:<8} checks={record['checks']:<9} "
+            f"nodes/s={rate:<8} first={seconds(record['time_to_first_grid'])} "
+            f"best={seconds(record['time_to_best_grid'])} grids={record['num_grids']} "
+            f"score={record['best_score']}{' (partial)' if record['partial'] else ''}")
+
+
+def compare(records: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Compares the records of a run with those of an earlier run.
+    :param records: Records of this run.
+    :param baseline: Output of an earlier run (see main()).
+    :param tolerance: Fraction by which a timing may get worse before it counts as a regression.
+    :return: List of regressions found: searches that now find worse grids, or take noticeably longer (see
+        MIN_REGRESSION).
+    """
+    old_records = {case_key(record): record for record in baseline["results"]}
+    regressions = []
+    for record in records:
+        old = old_records.get(case_key(record))
+        if old is None:
+            continue
+        name = f"{record['category']} {case_key(record)}"
+
+        if old["best_score"] is not None and (record["best_score"] is None or record["best_score"] > old["best_score"]):
+            regressions.append(f"{name}: best score {old['best_score']} -> {record['best_score']}")
+        for metric in ("elapsed", "time_to_best_grid"):
+            if old[metric] is None or record[metric] is None:
+                continue
+            if record[metric] > old[metric] * (1 + tolerance) and record[metric] - old[metric] >= MIN_REGRESSION:
+                regressions.append(f"{name}: {metric} {old[metric]:.3f}s -> {record[metric]:.3f}s")
+    return regressions
+
+
+def get_args(arg_list: Optional[Sequence[str]] = None):
+
+    parser = argparse.ArgumentParser(
+        prog=os.path.basename(__file__),
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+
+    parser.add_argument(
+        "-m", "--modes",
+        nargs="+",
+        choices=SEARCH_MODES,
+        default=list(SEARCH_MODES),
+        help="search modes to benchmark (for the exhaustive engine)"
+    )
+    parser.add_argument(
+        "-e", "--engines",
+        nargs="+",
+        choices=ENGINES,
+        default=["exhaustive"],
+        help="engines to benchmark"
+    )
+    parser.add_argument(
+        "-c", "--categories",
+        nargs="+",
+        choices=list(CORPUS),
+        help="categories of word sets to benchmark (default: all)"
+    )
+    parser.add_argument(
+        "-s", "--strictness",
+        action="store",
+        default="standard",
+        help="strictness of the grids searched for"
+    )
+    parser.add_argument(
+        "-t", "--time-limit",
+        action="store",
+        type=float,
+        default=TIME_LIMIT,
+        help="seconds after which each search stops early"
+    )
+    parser.add_argument(
+        "-r", "--repeat",
+        action="store",
+        type=int,
+        default=1,
+        help="number of times to run each search, keeping the fastest"
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="also measure peak memory allocated by Python with tracemalloc (which slows the searches, so timings "
+             "aren't comparable with runs without it)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        action="store",
+        help="file to write the results to as JSON (default: standard output)"
+    )
+    parser.add_argument(
+        "-b", "--baseline",
+        action="store",
+        help="results of an earlier run to compare against; exits with status 1 if any search regressed"
+    )
+    parser.add_argument(
+        "--tolerance",
+        action="store",
+        type=float,
+        default=TOLERANCE,
+        help="fraction by which a timing may get worse than the baseline before it counts as a regression"
+    )
+
+    return parser.parse_args(arg_list)
+
+
+def main():
+    args = get_args()
+
+    records = run_benchmark(args.modes, args.engines, args.strictness, args.time_limit, args.repeat,
+                            args.trace_memory, args.categories)
+    output = {
+        "engine_version": ENGINE_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "time_limit": args.time_limit,
+        "results": records
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(records, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("No regressions found.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,29 +6,41 @@ is 'coherent', and ideally maximises the number of intersections and minimises t
 
 """
 
-from typing import List, Tuple, Literal, Generator, Optional, Set, Dict, Union
+from typing import List, Tuple, Literal, Generator, Optional, Set, Dict, Union, Any, NamedTuple, Iterable, Callable
 
+import heapq
 import os
+import random
+import time
+import zlib
 
+from bisect import bisect_right
 from itertools import combinations
 
-from timeout_decorator import timeout
-
         
 Direction = Literal["A", "D"]
+# A word placed in a crossword, as (word, x, y, direction).
+PlacedWord = Tuple[str, int, int, Direction]
 
 
 class Word:
     ACROSS: Direction = "A"
     DOWN: Direction = "D"
 
+    # Words are created for every candidate placement in a search, so keep them small. They should be treated as
+    # immutable (see Word.shifted(...)), since the cells they cover are cached.
+    __slots__ = ("word", "length", "x", "y", "direction", "_cells")
+
     def __init__(self, word: str, x: int = 0, y: int = 0, direction: Direction = "A"):
         self.word = word.upper()    # TODO: more input parsing e.g. for spaces, punctuation.
         self.length = len(word)
         # self.chars = set(word)
 
         self.x, self.y = x, y
-        if direction.upper().startswith(Word.ACROSS):
+        self._cells: Optional[List[Tuple[int, int]]] = None
+        if direction == Word.ACROSS or direction == Word.DOWN:
+            self.direction = direction
+        elif direction.upper().startswith(Word.ACROSS):
             self.direction = Word.ACROSS
         elif direction.upper().startswith(Word.DOWN):
             self.direction = Word.DOWN
@@ -55,50 +67,284 @@ class Word:
     def shifted(self, x: int, y: int) -> 'Word':
         return Word(self.word, self.x + x, self.y + y, self.direction)
 
-    def find_intersections(self, new_word: str) -> List[Tuple[int, int]]:
+    def cells(self) -> List[Tuple[int, int]]:
+        """
+        Returns the (x, y) coordinates of the cells covered by this word, in reading order. The list should not be
+        modified.
+        """
+        if self._cells is None:
+            if self.direction == Word.ACROSS:
+                self._cells = [(self.x + i, self.y) for i in range(self.length)]
+            else:
+                self._cells = [(self.x, self.y + i) for i in range(self.length)]
+        return self._cells
+
+    def line(self) -> int:
+        """
+        Returns the row (for across words) or column (for down words) that this word lies in.
+        """
+        return self.y if self.direction == Word.ACROSS else self.x
+
+    def span(self) -> range:
+        """
+        Returns the range of columns (for across words) or rows (for down words) covered by this word.
+        """
+        start = self.x if self.direction == Word.ACROSS else self.y
+        return range(start, start + self.length)
+
+    def find_intersections(self, new_word: str,
+                           offsets: Optional[List[Tuple[int, int]]] = None) -> List[Tuple[int, int]]:
         """
         Returns a list of (x, y) tuples corresponding to positions a new word can be located to intersect with this word
         correctly.
         :param new_word: Content of a new word to intersect with this word.
+        :param offsets: shared_letter_offsets(self.word, new_word), if already known.
         :return: List of (x, y) tuples corresponding to potential word positions with valid intersections.
         """
-        positions: List[Tuple[int, int]] = []
+        if offsets is None:
+            offsets = shared_letter_offsets(self.word, new_word)
 
-        for offset, char in enumerate(self.word):
-            for new_offset, new_char in enumerate(new_word):
-                if char == new_char:
-                    x_offset, y_offset = 0, 0
+        x, y = self.x, self.y
+        if self.direction == Word.ACROSS:
+            return [(x + offset, y - new_offset) for offset, new_offset in offsets]
+        return [(x - new_offset, y + offset) for offset, new_offset in offsets]
 
-                    if self.direction == Word.ACROSS:
-                        x_offset, y_offset = offset, -new_offset
-                    elif self.direction == Word.DOWN:
-                        x_offset, y_offset = -new_offset, offset
 
-                    positions.append((self.x + x_offset, self.y + y_offset))
+def shared_letter_offsets(word1: str, word2: str) -> List[Tuple[int, int]]:
+    """
+    Returns every way two words can cross, as (index in word1, index in word2) pairs of matching letters.
+    :param word1: First word.
+    :param word2: Second word.
+    :return: List of (offset, new_offset) tuples, in order of offset then new_offset.
+    """
+    positions: Dict[str, List[int]] = {}
+    for new_offset, char in enumerate(word2):
+        positions.setdefault(char, []).append(new_offset)
+    return [(offset, new_offset) for offset, char in enumerate(word1) for new_offset in positions.get(char, ())]
+
+
+def canonical_key(words: Iterable[Word], transpose: bool = False) -> Tuple[PlacedWord, ...]:
+    """
+    Returns a key identifying a layout of words regardless of their order or position on the plane. Optionally, a
+    layout and its transpose (with across and down swapped) are given the same key, since they are equivalent grids.
+    :param words: Non-empty collection of words.
+    :param transpose: Whether to normalise the key under transposition.
+    :return: Tuple of (word, x, y, direction) tuples, relative to the top-left of the bounding box.
+    """
+    words = list(words)
+    x0 = min(w.x for w in words)
+    y0 = min(w.y for w in words)
+    key = tuple(sorted((w.word, w.x - x0, w.y - y0, w.direction) for w in words))
+    if not transpose:
+        return key
 
-        return positions
+    flipped = {Word.ACROSS: Word.DOWN, Word.DOWN: Word.ACROSS}
+    transposed_key = tuple(sorted((w.word, w.y - y0, w.x - x0, flipped[w.direction]) for w in words))
+    return min(key, transposed_key)
 
 
 class Crossword:
 
+    # Many partial crosswords are created during a search, most of which are never expanded, so each child only
+    # records its parent and the word added until its occupancy index is needed (see Crossword.ensure_index()).
+    __slots__ = ("words", "conflicts", "unsupported", "letters", "owners", "line_counts", "span_counts",
+                 "_parent", "_new_word")
+
     def __init__(self, words: List[Word]):
-        # Words are canonically sorted lexicographically. Only the words' x and y values should be considered mutable.
-        self.words = sorted(words, key=lambda w: w.word)
+        # Words are canonically sorted lexicographically.
+        self.words: Tuple[Word, ...] = tuple(sorted(words, key=lambda w: w.word))
+        self._parent: Optional[Crossword] = None
+        self._new_word: Optional[Word] = None
+        self.build_index()
         # Ensure top-left of bounding box is at (0,0).
         self.align()
 
+    def clear_index(self) -> None:
+        self.letters: Optional[Dict[Tuple[int, int], str]] = {}
+        self.owners: Dict[Direction, Dict[Tuple[int, int], Word]] = {Word.ACROSS: {}, Word.DOWN: {}}
+        self.line_counts: Dict[Direction, Dict[int, int]] = {Word.ACROSS: {}, Word.DOWN: {}}
+        self.span_counts: Dict[Direction, Dict[int, int]] = {Word.ACROSS: {}, Word.DOWN: {}}
+
+    def build_index(self) -> None:
+        """
+        Builds the cell-occupancy index from scratch, and determines the validity of the crossword from it. The index
+        consists of:
+         - letters: the letter in each occupied (x, y) cell.
+         - owners: for each direction, the word covering each cell in that direction.
+         - line_counts/span_counts: for each direction, how many words lie in each row/column, and how many words
+           extend over each column/row.
+        Validity is recorded as:
+         - conflicts: True if some pair of words is invalid in a way no further words can fix.
+         - unsupported: touching cells of parallel words that are not (yet) bridged by a perpendicular word.
+        :return: None
+        """
+        self.clear_index()
+        self.conflicts = False
+        self.unsupported: Set[Tuple[Direction, Tuple[int, int]]] = set()
+
+        for word in self.words:
+            self.conflicts = self.conflicts or self.conflicts_with(word)
+            bridged, unbridged = self.touching_cells(word)
+            self.unsupported = (self.unsupported - bridged) | unbridged
+            self.index_word(word)
+
+    def ensure_index(self) -> None:
+        """
+        Builds the occupancy index if it has not been built yet, by extending the parent crossword's index (for a
+        crossword from Crossword.add_word(...)) or from scratch (if the crossword has been shifted since).
+        :return: None
+        """
+        if self.letters is not None:
+            return
+
+        parent = self._parent
+        if parent is None:
+            self.clear_index()
+            for word in self.words:
+                self.index_word(word)
+            return
+
+        parent.ensure_index()
+        self.letters = parent.letters.copy()
+        self.owners = {d: owners.copy() for d, owners in parent.owners.items()}
+        self.line_counts = {d: counts.copy() for d, counts in parent.line_counts.items()}
+        self.span_counts = {d: counts.copy() for d, counts in parent.span_counts.items()}
+        self.index_word(self._new_word)
+        # The parent is no longer needed, so don't keep it alive.
+        self._parent = self._new_word = None
+
+    def conflicts_with(self, word: Word) -> bool:
+        """
+        Checks whether a new word would break the crossword in a way that adding further words cannot repair, namely
+        if it overlaps a parallel word in the same row/column, or it is perpendicular to another word and the two do
+        not intersect consistently (see Crossword.valid_pair(...)). Only the cells covered by the word are inspected.
+        :param word: Word to be checked against this crossword (which should not already contain it).
+        :return: True if the word conflicts with this crossword, False otherwise.
+        """
+        self.ensure_index()
+        other = Word.DOWN if word.direction == Word.ACROSS else Word.ACROSS
+        parallel_owners, other_owners = self.owners[word.direction], self.owners[other]
+
+        crossings = 0
+        for cell, char in zip(word.cells(), word.word):
+            if cell in parallel_owners:
+                return True
+            if cell in other_owners:
+                if self.letters[cell] != char:
+                    return True
+                crossings += 1
+
+        # Every perpendicular word extending over this word's line, and every perpendicular word lying within this
+        # word's span, must actually cross it.
+        if self.span_counts[other].get(word.line(), 0) != crossings:
+            return True
+        line_counts = self.line_counts[other]
+        return sum(line_counts.get(i, 0) for i in word.span()) != crossings
+
+    def touching_cells(self, word: Word) -> Tuple[Set[Tuple[Direction, Tuple[int, int]]],
+                                                  Set[Tuple[Direction, Tuple[int, int]]]]:
+        """
+        Determines how a new word would change the set of unsupported touching cells, looking only at the cells
+        covered by the word and their neighbours.
+        :param word: Word to be checked against this crossword (which should not already contain it).
+        :return: Tuple of (entries the word would bridge, new unsupported entries the word would create).
+        """
+        self.ensure_index()
+        direction = word.direction
+        other = Word.DOWN if direction == Word.ACROSS else Word.ACROSS
+        parallel_owners, other_owners = self.owners[direction], self.owners[other]
+        side_x, side_y = (0, 1) if direction == Word.ACROSS else (1, 0)
+        cells = word.cells()
+
+        # This word bridges any pair of touching perpendicular words that lie either side of two consecutive cells.
+        bridged = {(other, cell) for cell in cells[:-1]}
+
+        # Parallel words touching this word side-to-side must be bridged by a single perpendicular word.
+        unbridged = set()
+        for x, y in cells:
+            for neighbour in ((x - side_x, y - side_y), (x + side_x, y + side_y)):
+                if neighbour not in parallel_owners:
+                    continue
+                bridge = other_owners.get((x, y))
+                if bridge is None or other_owners.get(neighbour) is not bridge:
+                    unbridged.add((direction, min((x, y), neighbour)))
+
+        return bridged, unbridged
+
+    def index_word(self, word: Word) -> None:
+        """
+        Adds a word's cells to the occupancy index.
+        :param word: Word to add to the index.
+        :return: None
+        """
+        parallel_owners = self.owners[word.direction]
+        for cell, char in zip(word.cells(), word.word):
+            self.letters[cell] = char
+            parallel_owners[cell] = word
+
+        line_counts = self.line_counts[word.direction]
+        line_counts[word.line()] = line_counts.get(word.line(), 0) + 1
+        span_counts = self.span_counts[word.direction]
+        for i in word.span():
+            span_counts[i] = span_counts.get(i, 0) + 1
+
+    def touches_parallel(self, word: Word) -> bool:
+        """
+        Checks whether a new word would touch a parallel word, either side-to-side or end-to-end, whether or not the
+        touching cells are bridged by perpendicular words. (Forbidden in "strict" grids; see STRICTNESS_LEVELS.)
+        :param word: Word to be checked against this crossword (which should not already contain it).
+        :return: True if the word touches a parallel word, False otherwise.
+        """
+        self.ensure_index()
+        parallel_owners = self.owners[word.direction]
+        side_x, side_y = (0, 1) if word.direction == Word.ACROSS else (1, 0)
+        cells = word.cells()
+
+        for x, y in cells:
+            if (x - side_x, y - side_y) in parallel_owners or (x + side_x, y + side_y) in parallel_owners:
+                return True
+        (first_x, first_y), (last_x, last_y) = cells[0], cells[-1]
+        return (first_x - side_y, first_y - side_x) in parallel_owners or \
+            (last_x + side_y, last_y + side_x) in parallel_owners
+
     def is_valid(self) -> bool:
         """
-        Checks that words are pairwise 'valid', where 'valid' is defined by the Crossword.valid_pair(...) method.
+        Checks that words are pairwise 'valid', where 'valid' is defined by the Crossword.valid_pair(...) method. This
+        is read straight off the validity record, which is kept up to date as words are added.
         :return: True if crossword is 'valid', False otherwise.
         """
-        for w1, w2 in combinations(self.words, 2):
-            if not self.valid_pair(w1, w2):
-                return False
-        return True
+        return not self.conflicts and not self.unsupported
+
+    def is_valid_with(self, word: Word) -> bool:
+        """
+        Checks whether the crossword would be valid with a new word added, without constructing the new crossword.
+        :param word: Word to be checked against this crossword (which should not already contain it).
+        :return: True if crossword would be 'valid', False otherwise.
+        """
+        if self.conflicts or self.conflicts_with(word):
+            return False
+        bridged, unbridged = self.touching_cells(word)
+        return not unbridged and self.unsupported <= bridged
 
     def add_word(self, word: Word) -> 'Crossword':
-        return Crossword(self.words + [word])
+        """
+        Returns a new crossword with the given word added. The new crossword is not re-aligned, and shares this
+        crossword's occupancy index until it needs its own (see Crossword.ensure_index()).
+        :param word: Word to add.
+        :return: New Crossword instance.
+        """
+        crossword = Crossword.__new__(Crossword)
+        i = bisect_right(self.words, word.word, key=lambda w: w.word)
+        crossword.words = self.words[:i] + (word,) + self.words[i:]
+
+        crossword.conflicts = self.conflicts or self.conflicts_with(word)
+        bridged, unbridged = self.touching_cells(word)
+        crossword.unsupported = (self.unsupported - bridged) | unbridged
+
+        crossword.letters = None
+        crossword._parent = self
+        crossword._new_word = word
+        return crossword
 
     def valid_pair(self, w1: Word, w2: Word) -> bool:
         """
@@ -155,7 +401,14 @@ class Crossword:
         """
         x_shift = min(w.x for w in self.words) - x
         y_shift = min(w.y for w in self.words) - y
-        self.words = [w.shifted(-x_shift, -y_shift) for w in self.words]
+        if x_shift != 0 or y_shift != 0:
+            self.words = tuple(w.shifted(-x_shift, -y_shift) for w in self.words)
+            self.unsupported = {(d, (cx - x_shift, cy - y_shift)) for d, (cx, cy) in self.unsupported}
+
+        # Shifting can't change validity, so only the cell positions need re-indexing. That is left until needed, since
+        # finished grids (which are aligned once found) never need it, and they shouldn't keep their parents alive.
+        self.letters = None
+        self._parent = self._new_word = None
 
     def get_bounding_box(self) -> Tuple[int, int]:
         # Determine grid dimensions
@@ -168,6 +421,17 @@ class Crossword:
         width, height = self.get_bounding_box()
         return width * height
 
+    def get_extent(self) -> Tuple[int, int]:
+        """
+        Returns the width and height of the area covered by the words, whether or not the crossword is aligned or
+        connected (unlike Crossword.get_bounding_box()).
+        """
+        min_x = min(w.x for w in self.words)
+        min_y = min(w.y for w in self.words)
+        max_x = max(w.x + (w.length if w.direction == Word.ACROSS else 1) for w in self.words)
+        max_y = max(w.y + (w.length if w.direction == Word.DOWN else 1) for w in self.words)
+        return max_x - min_x, max_y - min_y
+
     def display(self) -> None:
         return self.display_string()
     
@@ -237,6 +501,22 @@ class Crossword:
         w, h = self.get_bounding_box()
         return max(w, h) / min(w, h)
 
+    def score(self) -> Tuple[int, int, float]:
+        """
+        Returns the key by which grids are ranked (lower is better): maximise number of crossings, then minimise size,
+        and minimise aspect ratio.
+        """
+        return -self.count_crossings(), self.get_size(), self.get_aspect_ratio()
+
+    def canonical_key(self, transpose: bool = False) -> Tuple[PlacedWord, ...]:
+        """
+        Returns a key identifying the layout of this crossword regardless of the order its words were added in or its
+        position on the plane (see canonical_key(...)).
+        :param transpose: Whether to normalise the key under transposition.
+        :return: Tuple of (word, x, y, direction) tuples, relative to the top-left of the bounding box.
+        """
+        return canonical_key(self.words, transpose)
+
     def __eq__(self, other):
         return self.words == other.words
 
@@ -244,7 +524,7 @@ class Crossword:
         return hash(tuple(self.words))
 
     def __repr__(self):
-        return f"Crossword({self.words})"
+        return f"Crossword({list(self.words)})"
 
 
 class NoValidFill(Exception):
@@ -260,6 +540,7 @@ def fill_crossword(crossword: Crossword, words_to_add: List[str]) -> Crossword:
     :return: Crossword with words added.
     """
     if not words_to_add:
+        crossword.align()
         return crossword
 
     for current_word in crossword.words:
@@ -280,102 +561,1050 @@ def fill_crossword(crossword: Crossword, words_to_add: List[str]) -> Crossword:
         raise NoValidFill
 
 
+class BestGrids:
+    """
+    Collection of the (up to) k best grids seen so far, ranked by Crossword.score().
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        # Max-heap (by score) of (negated score, insertion count, crossword), so the worst grid kept is at the top.
+        self.heap: List[Tuple[Tuple[int, int, float], int, Crossword]] = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def is_full(self) -> bool:
+        return len(self.heap) >= self.k
+
+    def worst_score(self) -> Tuple[int, int, float]:
+        """
+        Returns the score of the worst grid kept. Should only be called if the collection is non-empty.
+        """
+        crossings, size, aspect_ratio = self.heap[0][0]
+        return -crossings, -size, -aspect_ratio
+
+    def add(self, crossword: Crossword, score: Optional[Tuple[int, int, float]] = None) -> bool:
+        """
+        Adds a grid to the collection if it is among the k best seen so far.
+        :param crossword: Complete crossword.
+        :param score: crossword.score(), if already known.
+        :return: True if the grid was kept, False otherwise.
+        """
+        crossings, size, aspect_ratio = crossword.score() if score is None else score
+        entry = ((-crossings, -size, -aspect_ratio), self.count, crossword)
+        self.count += 1
+
+        if not self.is_full():
+            heapq.heappush(self.heap, entry)
+            return True
+        if entry[0] > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+    def grids(self) -> List[Crossword]:
+        """
+        Returns the grids kept, best first.
+        """
+        return [crossword for _, _, crossword in sorted(self.heap, reverse=True)]
+
+
+class Search:
+    """
+    State shared by every node of a single run of generate_crosswords(...).
+    """
+
+    def __init__(self, transpose_symmetry: bool = False, best: Optional[BestGrids] = None,
+                 deadline: Optional[float] = None, node_limit: Optional[int] = None, strictness: str = "standard",
+                 forward_checking: bool = False):
+        """
+        :param transpose_symmetry: If True, a grid and its transpose are treated as the same grid, so only one of them
+            is generated.
+        :param best: If provided, the search runs in branch-and-bound mode: any partial crossword that cannot be
+            completed into a grid scoring better than the worst grid in best is pruned. The caller is responsible for
+            adding the grids yielded to best.
+        :param deadline: Time (as given by time.monotonic()) after which the search stops early.
+        :param node_limit: Number of partial crosswords after which the search stops early.
+        :param strictness: One of STRICTNESS_LEVELS, determining which grids are allowed.
+        :param forward_checking: If True, partial crosswords that can no longer be completed (see forward_check(...))
+            are pruned as soon as they are reached.
+        """
+        self.transpose_symmetry = transpose_symmetry
+        self.strictness = strictness
+        self.forward_checking = forward_checking
+        self.best = best
+        self.deadline = deadline
+        self.node_limit = node_limit
+        # Score that a grid must beat to be worth finding, if already known (e.g. from an earlier search), for
+        # branch-and-bound mode.
+        self.bound: Optional[Tuple[int, int, float]] = None
+        # When searching one shard of a split search (see Search.restrict_to_shard(...)), the rank of the shard's
+        # root, the ranks of every shard root (by canonical key), and the number of words in a root.
+        self.shard_rank: Optional[Tuple[int, Tuple[PlacedWord, ...]]] = None
+        self.shard_ranks: Dict[Tuple[PlacedWord, ...], Tuple[int, Tuple[PlacedWord, ...]]] = {}
+        self.shard_size = 0
+        # Number of partial crosswords expanded so far, and of placements of words checked for validity.
+        self.nodes = 0
+        self.checks = 0
+        # Set to "time_limit_reached" or "node_limit_reached" if the search stops early.
+        self.interrupted: Optional[str] = None
+        # Hashes of the canonical keys of every partial crossword expanded so far.
+        self.visited: Set[int] = set()
+        # Table of the ways each pair of words can cross (see shared_letter_offsets(...)), filled in as pairs are
+        # first needed, so each pair's letters are only compared once per search.
+        self.offsets: Dict[Tuple[str, str], List[Tuple[int, int]]] = {}
+
+    def first_visit(self, crossword: Crossword) -> bool:
+        """
+        Records a (partial) crossword in the table of visited states.
+        :param crossword: Crossword about to be expanded.
+        :return: True if no equivalent crossword has been visited before, False otherwise.
+        """
+        key = hash(crossword.canonical_key(self.transpose_symmetry))
+        if key in self.visited:
+            return False
+        self.visited.add(key)
+        return True
+
+    def out_of_budget(self) -> bool:
+        """
+        Cooperative check (in place of a signal-based timeout) of whether the search should stop early. Once it
+        returns True, it will keep returning True.
+        :return: True if the deadline has passed or the node limit has been reached, False otherwise.
+        """
+        if self.interrupted:
+            return True
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.interrupted = "node_limit_reached"
+        elif self.deadline is not None and time.monotonic() > self.deadline:
+            self.interrupted = "time_limit_reached"
+        return self.interrupted is not None
+
+    def restrict_to_shard(self, shard_root: List[PlacedWord], shard_roots: List[List[PlacedWord]]) -> None:
+        """
+        Restricts the search to the partial crosswords 'owned' by one shard of a split search. A partial crossword can
+        be reached from every shard root it contains (up to position, and transposition if enabled), so it is only
+        expanded in the shard whose root has the least rank. Roots are ranked by a checksum of their key (which, unlike
+        hash(...), is the same in every process) to spread the partial crosswords evenly between shards.
+        :param shard_root: Words placed in the root of the shard being searched.
+        :param shard_roots: Words placed in the root of every shard (all with the same number of words).
+        :return: None
+        """
+        for root in shard_roots:
+            key = canonical_key((Word(*word) for word in root), self.transpose_symmetry)
+            self.shard_ranks[key] = (zlib.crc32(repr(key).encode()), key)
+        self.shard_rank = self.shard_ranks[canonical_key((Word(*word) for word in shard_root), self.transpose_symmetry)]
+        self.shard_size = len(shard_root)
+
+    def owns(self, crossword: Crossword) -> bool:
+        """
+        Checks whether a partial crossword should be expanded in the shard being searched (if any).
+        :param crossword: Partial crossword.
+        :return: True if the crossword belongs to this shard, False otherwise.
+        """
+        if self.shard_rank is None:
+            return True
+        for words in combinations(crossword.words, self.shard_size):
+            rank = self.shard_ranks.get(canonical_key(words, self.transpose_symmetry))
+            if rank is not None and rank < self.shard_rank:
+                return False
+        return True
+
+    def crossing_offsets(self, word1: str, word2: str) -> List[Tuple[int, int]]:
+        """
+        Looks up shared_letter_offsets(word1, word2) in the search's table, computing it if necessary.
+        """
+        offsets = self.offsets.get((word1, word2))
+        if offsets is None:
+            offsets = self.offsets[word1, word2] = shared_letter_offsets(word1, word2)
+        return offsets
+
+    def can_cross(self, word1: str, word2: str) -> bool:
+        return bool(self.crossing_offsets(word1, word2))
+
+    def optimistic_score(self, crossword: Crossword, words_to_add: List[str]) -> Tuple[int, int, float]:
+        """
+        Returns a score that no grid built by adding words_to_add to crossword can beat, by bounding:
+         - crossings from above: each remaining word can cross each other word at most once, and only if they share a
+           letter, and crossings are between across and down words only.
+         - size from below: the grid can only grow, and must fit the longest remaining word one way or the other.
+         - aspect ratio from below, by 1.
+        :param crossword: Partial crossword (without conflicts).
+        :param words_to_add: Words still to be added.
+        :return: Optimistic score, comparable with Crossword.score().
+        """
+        placed = [w.word for w in crossword.words]
+        new_crossings = 0
+        for i, word in enumerate(words_to_add):
+            new_crossings += sum(self.can_cross(word, other) for other in placed + words_to_add[i + 1:])
+
+        across = sum(w.direction == Word.ACROSS for w in crossword.words)
+        down = len(crossword.words) - across
+        max_crossings = max((across + i) * (down + len(words_to_add) - i) for i in range(len(words_to_add) + 1))
+        crossings = min(crossword.count_crossings() + new_crossings, max_crossings)
+
+        width, height = crossword.get_extent()
+        longest = max((len(word) for word in words_to_add), default=0)
+        size = min(max(width, longest) * height, width * max(height, longest))
+
+        return -crossings, size, 1.0
+
+    def can_improve(self, crossword: Crossword, words_to_add: List[str]) -> bool:
+        """
+        Checks whether a partial crossword could still be completed into one of the best grids.
+        :param crossword: Partial crossword (without conflicts).
+        :param words_to_add: Words still to be added.
+        :return: False if the crossword can be pruned, True otherwise.
+        """
+        if self.best is None:
+            return True
+        threshold = self.best.worst_score() if self.best.is_full() else self.bound
+        if threshold is None:
+            return True
+        return self.optimistic_score(crossword, words_to_add) < threshold
+
+
+def initial_crossword(words_to_add: List[str]) -> Tuple[Crossword, List[str]]:
+    """
+    Returns the crossword that every search starts from (the first word, placed across), along with the words that
+    remain to be added to it. Since every word must be used, nothing is gained by starting from any other word.
+    :param words_to_add: Non-empty list of words (as strings).
+    :return: Tuple of (initial crossword, remaining words).
+    """
+    init_wordlist = words_to_add.copy()
+    init_word = init_wordlist.pop(0)
+    return Crossword([Word(init_word)]), init_wordlist
+
+
+def child_crosswords(crossword: Crossword, words_to_add: List[str],
+                     search: Search) -> Generator[Tuple[Crossword, List[str]], None, None]:
+    """
+    Iterator that yields each crossword obtained by adding one of words_to_add to a (partial) crossword so that it
+    crosses an existing word, along with the words that then remain to be added. Children that are invalid beyond
+    repair, already visited, or (in branch-and-bound mode) unable to improve on the best grids are skipped.
+    :param crossword: Partial crossword to expand.
+    :param words_to_add: Non-empty list of words (as strings) still to be added.
+    :param search: State shared across the search.
+    :return:
+    """
+    # The remaining words are a multiset: adding either copy of a repeated word gives the same child, so each distinct
+    # word is only tried once. Similarly, a placement that crosses several words (or crosses a word at several
+    # matching letters, e.g. in runs of a repeated letter) is only tried once.
+    distinct_words = list(dict.fromkeys(words_to_add))
+    tried: Set[PlacedWord] = set()
+
+    for current_word in crossword.words:
+        new_direction = Word.DOWN if current_word.direction == Word.ACROSS else Word.ACROSS
+        for new_word_str in distinct_words:
+            positions = current_word.find_intersections(new_word_str,
+                                                        search.crossing_offsets(current_word.word, new_word_str))
+            for x, y in positions:
+                placement = (new_word_str, x, y, new_direction)
+                if placement in tried:
+                    continue
+                tried.add(placement)
+                if search.out_of_budget():
+                    return
+                search.checks += 1
+                new_word = Word(new_word_str, x, y, new_direction)
+                # Conflicts can never be repaired by adding more words, so prune them straight away. Only the final
+                # word needs to leave the whole crossword valid.
+                if len(words_to_add) > 1:
+                    if crossword.conflicts_with(new_word):
+                        continue
+                elif not crossword.is_valid_with(new_word):
+                    continue
+                # In strict grids, touching parallel words can't be repaired either.
+                if search.strictness == "strict" and crossword.touches_parallel(new_word):
+                    continue
+                new_crossword = crossword.add_word(new_word)
+                if not search.owns(new_crossword):
+                    continue
+                # The remaining words are determined by the words placed, so equivalent crosswords have identical
+                # subtrees.
+                if not search.first_visit(new_crossword):
+                    continue
+                new_wordlist = words_to_add.copy()
+                new_wordlist.remove(new_word_str)
+                if not search.can_improve(new_crossword, new_wordlist):
+                    continue
+                if search.forward_checking and not forward_check(new_crossword, new_wordlist, search):
+                    continue
+                yield new_crossword, new_wordlist
+
+
+def can_attach(crossword: Crossword, word: str, search: Search) -> bool:
+    """
+    Checks whether a word can be added to a partial crossword, crossing one of its words, without conflicts (or, in
+    "strict" mode, touching a parallel word). Since adding more words never removes these problems, a word that can't
+    be attached now can only be attached later by crossing one of the words added in the meantime.
+    :param crossword: Partial crossword.
+    :param word: Word (as a string) to be added.
+    :param search: State shared across the search.
+    :return: True if the word can be attached, False otherwise.
+    """
+    for current_word in crossword.words:
+        new_direction = Word.DOWN if current_word.direction == Word.ACROSS else Word.ACROSS
+        for x, y in current_word.find_intersections(word, search.crossing_offsets(current_word.word, word)):
+            new_word = Word(word, x, y, new_direction)
+            if crossword.conflicts_with(new_word):
+                continue
+            if search.strictness == "strict" and crossword.touches_parallel(new_word):
+                continue
+            return True
+    return False
+
+
+def forward_check(crossword: Crossword, words_to_add: List[str], search: Search) -> bool:
+    """
+    Looks ahead from a partial crossword (without conflicts) to check that it could still be completed, namely that:
+     - each pair of touching parallel words not yet bridged could be bridged by one of the remaining words, since the
+       bridging word must contain the two touching letters in order.
+     - each remaining word could be attached, either to the crossword as it is now, or to another remaining word.
+    :param crossword: Partial crossword.
+    :param words_to_add: Non-empty list of words (as strings) still to be added.
+    :param search: State shared across the search.
+    :return: False if the crossword can be pruned, True otherwise.
+    """
+    crossword.ensure_index()
+    for direction, (x, y) in crossword.unsupported:
+        neighbour = (x, y + 1) if direction == Word.ACROSS else (x + 1, y)
+        letters = crossword.letters[x, y] + crossword.letters[neighbour]
+        if not any(letters in word for word in words_to_add):
+            return False
+
+    for i, word in enumerate(words_to_add):
+        if any(search.can_cross(word, other) for j, other in enumerate(words_to_add) if j != i):
+            continue
+        if not can_attach(crossword, word, search):
+            return False
+    return True
+
+
 def generate_crosswords(words_to_add: List[str],
-                        crossword: Optional[Crossword] = None) -> Generator[Crossword, None, None]:
+                        crossword: Optional[Crossword] = None,
+                        search: Optional[Search] = None) -> Generator[Crossword, None, None]:
     """
-    Iterator that yields all* valid connected crosswords built using all the words from words_to_add. Optional crossword
+    Iterator that yields all valid connected crosswords built using all the words from words_to_add. Optional crossword
     argument to provide a partial crossword structure with some remaining words to be added.
 
-    *The recursive nature of the definition with no look-ahead means that certain structures (e.g. 'pinwheels' where a
-    2x2 section of the grid is contained in four words overlapping) would require invalid grids at intermediate stages.
+    Which grids count as valid depends on the search's strictness (see STRICTNESS_LEVELS). Touching parallel words
+    that are not yet bridged are allowed at intermediate stages, since a later word may bridge them, so structures
+    like 'pinwheels' (where a 2x2 section of the grid is contained in four words overlapping) can be built.
 
-    TODO: add levels of 'strictness' that allow e.g. pinwheels or even no adjacent and parallel clues.
+    The same partial crossword can be reached by adding its words in many different orders. Each partial crossword is
+    only expanded the first time it is reached, so each grid is yielded at most once.
+
+    If the search runs out of time or nodes (see Search.out_of_budget()), the iterator simply stops, so that the grids
+    already yielded can still be used.
 
     :param words_to_add:
     :param crossword:
+    :param search: State shared across the recursion (e.g. the table of visited partial crosswords).
     :return:
     """
+    if search is None:
+        search = Search()
+
     # If no words are left to add, we are done.
     if not words_to_add:
         crossword.align()
         yield crossword
         return
 
-    # If crossword is empty, exhaust over possible initial words.
+    # If crossword is empty, start from the initial word.
     if crossword is None:
-        for word in words_to_add:
-            init_wordlist = words_to_add.copy()
-            init_wordlist.remove(word)
+        crossword, words_to_add = initial_crossword(words_to_add)
+        yield from generate_crosswords(words_to_add, crossword, search)
+        return
 
-            init_word = Word(word)
-            init_crossword = Crossword([init_word])
+    search.nodes += 1
+    for new_crossword, new_wordlist in child_crosswords(crossword, words_to_add, search):
+        yield from generate_crosswords(new_wordlist, new_crossword, search)
 
-            yield from generate_crosswords(init_wordlist, init_crossword)
-            return
 
-    for current_word in crossword.words:
+# A shard is a partial crossword, along with the words still to be added.
+Shard = Tuple[List[PlacedWord], List[str]]
+
+
+def split_search(words_to_add: List[str], min_shards: int, max_depth: int = 2,
+                 strictness: str = "standard") -> List[Shard]:
+    """
+    Splits the search tree explored by generate_crosswords(words_to_add) into independent subtrees, by expanding its
+    first few levels until there are at least min_shards of them (or max_depth levels have been expanded).
+    :param words_to_add: Non-empty list of words (as strings).
+    :param min_shards: Number of shards to aim for.
+    :param max_depth: Maximum number of words to add beyond the initial word.
+    :param strictness: One of STRICTNESS_LEVELS.
+    :return: List of shards, which between them cover every grid.
+    """
+    search = Search(TRANSPOSE_SYMMETRY, strictness=strictness, forward_checking=FORWARD_CHECKING)
+    frontier = [initial_crossword(words_to_add)]
+    for _ in range(max_depth):
+        if len(frontier) >= min_shards or not all(words for _, words in frontier):
+            break
+        frontier = [child for crossword, words in frontier for child in child_crosswords(crossword, words, search)]
+
+    # Search the most promising shards first, so that good bounds are found early in "best" mode.
+    frontier.sort(key=lambda child: search.optimistic_score(*child))
+    return [([(w.word, w.x, w.y, w.direction) for w in crossword.words], words) for crossword, words in frontier]
+
+
+def is_connected(crossword: Crossword) -> bool:
+    """
+    Checks whether every word in a crossword can be reached from every other by following crossings.
+    :param crossword: Non-empty crossword.
+    :return: True if the crossword is connected, False otherwise.
+    """
+    crossword.ensure_index()
+    reached = {id(crossword.words[0])}
+    to_visit = [crossword.words[0]]
+    while to_visit:
+        word = to_visit.pop()
+        other_owners = crossword.owners[Word.DOWN if word.direction == Word.ACROSS else Word.ACROSS]
+        for cell in word.cells():
+            other = other_owners.get(cell)
+            if other is not None and id(other) not in reached:
+                reached.add(id(other))
+                to_visit.append(other)
+    return len(reached) == len(crossword.words)
+
+
+def placements(crossword: Crossword, word: str, search: Search,
+               crossing: Optional[Iterable[Word]] = None) -> List[Word]:
+    """
+    Returns every placement of a word crossing one of the words in a crossword that keeps the crossword valid (and, in
+    "strict" mode, doesn't touch a parallel word).
+    :param crossword: Crossword to add the word to.
+    :param word: Word (as a string) to place.
+    :param search: State shared across the search.
+    :param crossing: Words to consider crossing, if not every word in the crossword.
+    :return: List of placed words.
+    """
+    result = []
+    for current_word in crossword.words if crossing is None else crossing:
         new_direction = Word.DOWN if current_word.direction == Word.ACROSS else Word.ACROSS
-        for new_word_str in words_to_add:
-            positions = current_word.find_intersections(new_word_str)
-            for x, y in positions:
-                new_word = Word(new_word_str, x, y, new_direction)
+        for x, y in current_word.find_intersections(word, search.crossing_offsets(current_word.word, word)):
+            new_word = Word(word, x, y, new_direction)
+            search.checks += 1
+            if not crossword.is_valid_with(new_word):
+                continue
+            if search.strictness == "strict" and crossword.touches_parallel(new_word):
+                continue
+            result.append(new_word)
+    return result
+
+
+def placement_score(crossword: Crossword, word: Word, extent: Tuple[int, int, int, int]) -> Tuple[int, int]:
+    """
+    Returns the key by which placements of a word are ranked by the greedy engine (lower is better): maximise the
+    number of crossings, then minimise the area of the resulting bounding box.
+    :param crossword: Crossword the word is to be added to.
+    :param word: Placed word.
+    :param extent: The crossword's (min_x, min_y, max_x, max_y), with max_x and max_y exclusive.
+    :return: Tuple of (negated crossings, area).
+    """
+    crossword.ensure_index()
+    crossings = sum(cell in crossword.letters for cell in word.cells())
+    (first_x, first_y), (last_x, last_y) = word.cells()[0], word.cells()[-1]
+    min_x, min_y, max_x, max_y = extent
+    width = max(max_x, last_x + 1) - min(min_x, first_x)
+    height = max(max_y, last_y + 1) - min(min_y, first_y)
+    return -crossings, width * height
+
+
+def may_interact(word: Word, other: Word) -> bool:
+    """
+    Checks cheaply whether two words lie close enough together that adding one to a grid could stop the other from
+    fitting (see Crossword.is_valid_with(...) and Crossword.touches_parallel(...)): perpendicular words interact if
+    either lies across the other's line, and parallel words if they lie in the same or adjacent lines and their spans
+    overlap or meet.
+    """
+    if word.direction != other.direction:
+        return word.line() in other.span() or other.line() in word.span()
+    span, other_span = word.span(), other.span()
+    return abs(word.line() - other.line()) <= 1 and span.start <= other_span.stop and other_span.start <= span.stop
+
+
+def greedy_crossword(words: List[str], start: int, search: Search, rng: random.Random,
+                     node_limit: int) -> Optional[Crossword]:
+    """
+    Builds a single grid using every word, by repeatedly adding the most constrained word (the one with fewest
+    candidate placements, among those that can currently be placed) at its best placement (see placement_score(...)).
+    The grid is kept valid throughout. If the grid gets stuck, the next best placements (of that word, then of the other
+    words) are tried instead, up to a limit on the number of grids tried in total, so each attempt takes bounded time.
+
+    Candidate placements for each word are only generated against each newly placed word, and only candidates near
+    the new word (see may_interact(...)) are checked again, so each step is roughly linear in the number of words.
+    :param words: Non-empty list of words (as strings).
+    :param start: Index of the word to start from (placed across).
+    :param search: State shared across the search.
+    :param rng: Source of randomness for breaking ties, so that repeated attempts give different grids.
+    :param node_limit: Number of partial grids to try before giving up.
+    :return: Crossword, or None if the attempt got stuck (or ran out of time).
+    """
+    crossword = Crossword([Word(words[start])])
+    first = crossword.words[0]
+    extent = (first.x, first.y, first.x + first.length, first.y + 1)
+    candidates = {i: placements(crossword, words[i], search) for i in range(len(words)) if i != start}
+    nodes = 0
+
+    def fits(crossword: Crossword, word: Word) -> bool:
+        search.checks += 1
+        return crossword.is_valid_with(word) and \
+            not (search.strictness == "strict" and crossword.touches_parallel(word))
+
+    def extend(crossword: Crossword, extent: Tuple[int, int, int, int],
+               candidates: Dict[int, List[Word]]) -> Optional[Crossword]:
+        nonlocal nodes
+        if not candidates:
+            return crossword
+        nodes += 1
+        search.nodes += 1
+        if nodes > node_limit or search.out_of_budget():
+            return None
+
+        # A word with no candidates left can only be placed by crossing another word still to be placed.
+        for i, words_candidates in candidates.items():
+            if not words_candidates and not any(search.can_cross(words[i], words[j]) for j in candidates if j != i):
+                return None
+        # Try the placements of the most constrained word(s) first, best first, but (since that word may need to cross
+        # a word not yet placed) fall back on the placements of other words. The placements of less constrained words
+        # are only ranked once they're needed, which they rarely are.
+        for count in sorted({len(words_candidates) for words_candidates in candidates.values()} - {0}):
+            ranked = sorted(((placement_score(crossword, w, extent), rng.random(), i, w)
+                             for i, words_candidates in candidates.items() if len(words_candidates) == count
+                             for w in words_candidates), key=lambda entry: entry[:2])
+            for _, _, chosen, new_word in ranked:
                 new_crossword = crossword.add_word(new_word)
-                if len(words_to_add) > 1 or new_crossword.is_valid():
-                    new_wordlist = words_to_add.copy()
-                    new_wordlist.remove(new_word_str)
-                    yield from generate_crosswords(new_wordlist, new_crossword)
+                (first_x, first_y), (last_x, last_y) = new_word.cells()[0], new_word.cells()[-1]
+                new_extent = (min(extent[0], first_x), min(extent[1], first_y), max(extent[2], last_x + 1),
+                              max(extent[3], last_y + 1))
+                # Placements far from the new word still fit.
+                new_candidates = {i: [w for w in words_candidates
+                                      if not may_interact(w, new_word) or fits(new_crossword, w)]
+                                  + placements(new_crossword, words[i], search, crossing=[new_word])
+                                  for i, words_candidates in candidates.items() if i != chosen}
+                result = extend(new_crossword, new_extent, new_candidates)
+                if result is not None or nodes > node_limit or search.interrupted:
+                    return result
+        return None
+
+    crossword = extend(crossword, extent, candidates)
+    if crossword is not None:
+        crossword.align()
+    return crossword
+
+
+def improve_crossword(crossword: Crossword, search: Search) -> Crossword:
+    """
+    Local search: repeatedly takes a word out of a grid and puts it back in its best position, as long as that improves
+    the grid's score, until no single word can be moved to improve it. Words whose removal would disconnect the grid
+    are skipped without building the grid without them.
+    :param crossword: Complete, valid grid.
+    :param search: State shared across the search.
+    :return: Grid at least as good as the one given.
+    """
+    score = crossword.score()
+    improved = True
+    while improved and not search.out_of_budget():
+        improved = False
+        # The words each word crosses (by position in crossword.words).
+        crossword.ensure_index()
+        positions = {id(word): i for i, word in enumerate(crossword.words)}
+        crossings = []
+        for word in crossword.words:
+            other_owners = crossword.owners[Word.DOWN if word.direction == Word.ACROSS else Word.ACROSS]
+            crossings.append({positions[id(other_owners[cell])] for cell in word.cells() if cell in other_owners})
+
+        for removed, word in enumerate(crossword.words):
+            search.nodes += 1
+            rest = [other for other in crossword.words if other is not word]
+            if not rest:
+                break
+            # Check that the other words are still connected without the word.
+            first = 1 if removed == 0 else 0
+            reached = {removed, first}
+            to_visit = [first]
+            while to_visit:
+                for i in crossings[to_visit.pop()] - reached:
+                    reached.add(i)
+                    to_visit.append(i)
+            if len(reached) < len(crossword.words):
+                continue
+
+            remaining = Crossword(rest)
+            if not remaining.is_valid():
+                continue
+            for new_word in placements(remaining, word.word, search):
+                candidate = remaining.add_word(new_word)
+                candidate.align()
+                if candidate.score() < score:
+                    crossword, score, improved = candidate, candidate.score(), True
+            if improved:
+                break
+    return crossword
+
+
+def infeasibility(words: List[str]) -> Optional[str]:
+    """
+    Checks, without searching, for simple reasons that no connected crossword can use every word in a list:
+     - the words can't all be linked by shared letters (so some word, or group of words, can't connect to the rest).
+     - a connected grid of n words needs at least n - 1 crossings, and each letter of each word can be used in at most
+       one crossing, but too few letters are shared with other words to make that many crossings.
+    Passing these checks doesn't guarantee that a crossword exists.
+    :param words: Non-empty list of words (as strings).
+    :return: Explanation of why there are no crosswords, or None if the words might still form one.
+    """
+    if len(words) < 2:
+        return None
+    letters = [set(word) for word in words]
+
+    # Find the words linked to the first word by shared letters.
+    connected = {0}
+    to_visit = [0]
+    while to_visit:
+        i = to_visit.pop()
+        for j in range(len(words)):
+            if j not in connected and not letters[i].isdisjoint(letters[j]):
+                connected.add(j)
+                to_visit.append(j)
+
+    if len(connected) < len(words):
+        isolated = [word for i, word in enumerate(words)
+                    if all(letters[i].isdisjoint(other) for j, other in enumerate(letters) if j != i)]
+        if isolated:
+            return f"{isolated[0]} shares no letters with any other word."
+        group = [word for i, word in enumerate(words) if i not in connected]
+        rest = [word for i, word in enumerate(words) if i in connected]
+        group, rest = sorted((group, rest), key=len)
+        return f"{', '.join(group)} share no letters with {', '.join(rest)}."
+
+    # Count the letters of each word that appear in some other word, and so could be used in a crossing.
+    crossable = 0
+    for i, word in enumerate(words):
+        others = set().union(*(other for j, other in enumerate(letters) if j != i))
+        crossable += sum(char in others for char in word)
+    if crossable < 2 * (len(words) - 1):
+        return f"The words don't share enough letters to all be connected (at least {len(words) - 1} crossings are " \
+               f"needed)."
+
+    return None
 
 
 ITERATION_LIMIT = 10000
 TIME_LIMIT = 10
+# Optional cap on the number of partial crosswords expanded per request.
+NODE_LIMIT: Optional[int] = None
 MAX_GRIDS_RETURNED = 20
+# "enumerate" generates grids up to the iteration limit and keeps the best; "best" searches for the best grids directly.
+SEARCH_MODES = ("enumerate", "best")
+# Swapping across and down gives an equivalent grid, so only return one of each pair.
+TRANSPOSE_SYMMETRY = True
+# Rules for which grids are allowed:
+#  - "standard": parallel words may touch side-to-side if every touching pair of cells is bridged by a single
+#    perpendicular word (allowing e.g. 'pinwheels'), and may touch end-to-end.
+#  - "strict": parallel words may not touch at all.
+STRICTNESS_LEVELS = ("standard", "strict")
+# Whether to prune partial crosswords that can no longer be completed, rather than expanding them.
+FORWARD_CHECKING = True
+# Should be incremented whenever a change means the same request would return different grids (or a different
+# response), so that cached results are no longer used.
+ENGINE_VERSION = 3
+# "exhaustive" finds grids with generate_crosswords(...), so can only handle MAX_WORDS words; "greedy" builds grids a
+# word at a time with greedy_crossword(...) and improves them with improve_crossword(...), so handles up to
+# MAX_GREEDY_WORDS words, but may miss the best grids.
+ENGINES = ("exhaustive", "greedy")
+MAX_GREEDY_WORDS = 30
+# Number of grids the greedy engine builds (with different tie-breaks) before returning the best of them, for up to 10
+# words. Building a grid takes time roughly quadratic in its number of words, so longer word lists get proportionally
+# fewer attempts (but at least one starting from each word).
+GREEDY_ATTEMPTS = 100
+GREEDY_ATTEMPTS_WORDS = 10
+# Number of partial grids the greedy engine may try per word in each attempt, when it has to backtrack.
+GREEDY_NODES_PER_WORD = 100
+# In parallel mode, how many shards to split the search into per worker process...
+SHARDS_PER_WORKER = 4
+# ...and for how many seconds to search serially first.
+PROBE_TIME_LIMIT = 0.5
+
+
+class SearchResult(NamedTuple):
+    grids: List[Crossword]      # Best grids found, best first.
+    num_grids: int              # Number of unique grids found.
+    warnings: List[str]
+    partial: bool               # Whether the search stopped early (so better grids may exist).
+    infeasible: Optional[str] = None    # Reason there can't be any grids, if found without searching.
+    # Whether num_grids counts every grid there is, rather than only those the search happened to find (e.g. in "best"
+    # mode, which skips grids that can't beat those already found, so the count depends on the order it searches in).
+    num_grids_exact: bool = True
+
+
+# A grid in compact form, for sending between processes: (index of the word in the sorted list of words searched, x, y,
+# direction) for each word.
+PackedGrid = Tuple[Tuple[int, int, int, Direction], ...]
+
+
+class PackedResult(NamedTuple):
+    """
+    A SearchResult in compact form (see pack_result(...)), which is much quicker to send between processes.
+    """
+    grids: List[PackedGrid]
+    num_grids: int
+    warnings: List[str]
+    partial: bool
+    infeasible: Optional[str] = None
+    num_grids_exact: bool = True
+
+
+def pack_grid(crossword: Crossword, wordlist: List[str]) -> PackedGrid:
+    """
+    :param crossword: Crossword using the words in wordlist.
+    :param wordlist: Every word searched (in any order).
+    :return: PackedGrid, to be unpacked with unpack_grid(...) and the same words.
+    """
+    words = sorted(wordlist)
+    return tuple((words.index(w.word), w.x, w.y, w.direction) for w in crossword.words)
+
+
+def pack_result(result: SearchResult, wordlist: List[str]) -> PackedResult:
+    """
+    :param result: Result of a search.
+    :param wordlist: Every word searched (in any order).
+    :return: PackedResult, to be unpacked with unpack_result(...) and the same words.
+    """
+    grids = [pack_grid(xw, wordlist) for xw in result.grids]
+    return PackedResult(grids, result.num_grids, result.warnings, result.partial, result.infeasible,
+                        result.num_grids_exact)
+
+
+def unpack_grid(grid: PackedGrid, wordlist: List[str]) -> Crossword:
+    words = sorted(wordlist)
+    return Crossword([Word(words[i], x, y, direction) for i, x, y, direction in grid])
+
+
+def unpack_result(packed: PackedResult, wordlist: List[str]) -> SearchResult:
+    """
+    Reverses pack_result(...).
+    :param packed: PackedResult.
+    :param wordlist: Every word searched (in any order).
+    :return: SearchResult
+    """
+    grids = [unpack_grid(grid, wordlist) for grid in packed.grids]
+    return SearchResult(grids, packed.num_grids, packed.warnings, packed.partial, packed.infeasible,
+                        packed.num_grids_exact)
+
+
+class Improvements:
+    """
+    Passes each grid found that is better than every grid found before it to a callback (e.g. to stream them).
+    """
+
+    def __init__(self, callback: Optional[Callable[[Crossword], None]]):
+        self.callback = callback
+        self.best_score: Optional[Tuple[int, int, float]] = None
+
+    def found(self, crossword: Crossword, score: Optional[Tuple[int, int, float]] = None) -> None:
+        if self.callback is None:
+            return
+        if score is None:
+            score = crossword.score()
+        if self.best_score is None or score < self.best_score:
+            self.best_score = score
+            self.callback(crossword)
 
-def main(wordlist: List[str], json: bool) -> str:
+
+def search_grids(wordlist: List[str], mode: str = "enumerate", crossword: Optional[Crossword] = None,
+                 search: Optional[Search] = None,
+                 on_improvement: Optional[Callable[[Crossword], None]] = None) -> SearchResult:
+    """
+    Searches for the best grids using the words in wordlist (in addition to those in crossword, if provided).
+    :param wordlist: List of words (as strings) to be added.
+    :param mode: One of SEARCH_MODES.
+    :param crossword: Optional partial crossword to start from.
+    :param search: Optional search state, e.g. with a deadline or node limit.
+    :param on_improvement: Optional callback, called with each grid found that is better than all those before it.
+    :return: SearchResult
+    """
+    warnings = []
+    if search is None:
+        search = Search(TRANSPOSE_SYMMETRY, forward_checking=FORWARD_CHECKING)
+    improvements = Improvements(on_improvement)
+
+    # Don't search at all if it's clear there are no grids.
+    if crossword is None:
+        reason = infeasibility(wordlist)
+        if reason is not None:
+            return SearchResult([], 0, warnings, False, reason)
+
+    if mode == "best":
+        # Branch-and-bound: the search itself is steered towards the best grids, so no iteration limit is needed.
+        best = BestGrids(MAX_GRIDS_RETURNED)
+        search.best = best
+        num_grids = 0
+        for xw in generate_crosswords(wordlist, crossword, search):
+            num_grids += 1
+            score = xw.score()
+            best.add(xw, score)
+            improvements.found(xw, score)
+        best_grids = best.grids()
+
+    else:
+        # Only the best grids are kept (maximise number of crossings, then minimise size, and minimise aspect ratio),
+        # and a fingerprint (hash) of every other grid found, to count the unique grids, so memory use doesn't grow
+        # with the iteration limit. (Not search.best, which would turn on branch-and-bound.)
+        best = BestGrids(MAX_GRIDS_RETURNED)
+        fingerprints: Set[int] = set()
+        i = 0
+        for xw in generate_crosswords(wordlist, crossword, search):
+            i += 1
+            if i > ITERATION_LIMIT:
+                warnings.append("iteration_limit_reached")
+                break
+            fingerprint = hash(xw)
+            if fingerprint not in fingerprints:
+                fingerprints.add(fingerprint)
+                score = xw.score()
+                best.add(xw, score)
+                improvements.found(xw, score)
+        num_grids = len(fingerprints)
+        best_grids = best.grids()
+
+    # If the search was cut short, still return the best grids found so far.
+    if search.interrupted:
+        warnings.append(search.interrupted)
+
+    return SearchResult(best_grids, num_grids, warnings, search.interrupted is not None,
+                        num_grids_exact=(mode != "best"))
+
+
+def greedy_search(wordlist: List[str], search: Search,
+                  on_improvement: Optional[Callable[[Crossword], None]] = None) -> SearchResult:
+    """
+    Searches for good grids using the words in wordlist with the greedy engine (see ENGINES). The result is the same for
+    the same words, since the randomness used is seeded from them.
+    :param wordlist: Non-empty list of words (as strings).
+    :param search: Search state, e.g. with a deadline or node limit.
+    :param on_improvement: Optional callback, called with each grid found that is better than all those before it.
+    :return: SearchResult
+    """
+    improvements = Improvements(on_improvement)
+    reason = infeasibility(wordlist)
+    if reason is not None:
+        return SearchResult([], 0, [], False, reason)
+
+    rng = random.Random(",".join(sorted(wordlist)))
+    best = BestGrids(MAX_GRIDS_RETURNED)
+    seen = set()
+
+    # Take turns to start from each word, starting with words that can cross many others, and longer words.
+    starts = sorted(range(len(wordlist)), key=lambda i: (-sum(search.can_cross(wordlist[i], other)
+                                                              for other in wordlist), -len(wordlist[i])))
+    attempts = max(GREEDY_ATTEMPTS * GREEDY_ATTEMPTS_WORDS // max(len(wordlist), GREEDY_ATTEMPTS_WORDS), len(wordlist))
+    for attempt in range(attempts):
+        crossword = greedy_crossword(wordlist, starts[attempt % len(starts)], search, rng,
+                                     GREEDY_NODES_PER_WORD * len(wordlist))
+        if crossword is None:
+            if search.interrupted:
+                break
+            continue
+        crossword = improve_crossword(crossword, search)
+        key = crossword.canonical_key(TRANSPOSE_SYMMETRY)
+        if key not in seen:
+            seen.add(key)
+            score = crossword.score()
+            best.add(crossword, score)
+            improvements.found(crossword, score)
+
+    warnings = [search.interrupted] if search.interrupted else []
+    # Failing to find a grid doesn't mean there aren't any, so treat that like stopping early.
+    return SearchResult(best.grids(), len(seen), warnings, search.interrupted is not None or not seen,
+                        num_grids_exact=False)
+
+
+def prepare_parallel_search(wordlist: List[str], num_workers: int, strictness: str = "standard",
+                            queue=None) -> Tuple[List[Shard], PackedResult]:
+    """
+    First phase of a parallel search (in "best" mode), to be run in a worker process. A short serial search (a 'probe')
+    is run first: small searches finish within the probe, and otherwise the grids it finds give every shard a bound to
+    prune against from the start. The search is then split into shards, to be searched by search_shard(...).
+    :param wordlist: Non-empty list of words (as strings).
+    :param num_workers: Number of worker processes that will search the shards.
+    :param strictness: One of STRICTNESS_LEVELS.
+    :param queue: Optional queue to stream the probe's grids through as they are found (as for
+        process_generate_request(...)).
+    :return: Tuple of (shards, probe result, packed with pack_result(...)). There are no shards if the probe finished
+        the whole search.
+    """
     os.nice(10)
-    output = []
-    json_data = {"errors": [], "warnings": [], "grids": []}
-
-    crosswords: Set[Crossword] = set()
-    i = 0
-    for xw in generate_crosswords(wordlist):
-        i += 1
-        if i > ITERATION_LIMIT:
-            output.append("Warning! Iteration limit reached!")
-            json_data["warnings"].append("iteration_limit_reached")
-            break
-        if xw not in crosswords:
-            crosswords.add(xw)
+    search = Search(TRANSPOSE_SYMMETRY, deadline=time.monotonic() + PROBE_TIME_LIMIT, strictness=strictness,
+                    forward_checking=FORWARD_CHECKING)
+    on_improvement = None
+    if queue is not None:
+        on_improvement = lambda xw: queue.put({"type": "grid", "grid": pack_grid(xw, wordlist)})
+
+    probe = search_grids(wordlist, "best", search=search, on_improvement=on_improvement)
+    if not probe.partial:
+        return [], pack_result(probe, wordlist)
+
+    # The probe only stopped because of its own time limit, so don't pass that on.
+    probe = probe._replace(warnings=[], partial=False)
+    return split_search(wordlist, SHARDS_PER_WORKER * num_workers, strictness=strictness), pack_result(probe, wordlist)
+
+
+def result_bound(result: SearchResult) -> Optional[Tuple[int, int, float]]:
+    """
+    Returns the score that a grid must beat to improve on the grids in a SearchResult, if it has a full set of grids.
+    """
+    if len(result.grids) < MAX_GRIDS_RETURNED:
+        return None
+    return result.grids[-1].score()
+
+
+def search_shard(shard: Shard, shards: List[Shard], bound: Optional[Tuple[int, int, float]] = None,
+                 deadline: Optional[float] = None, node_limit: Optional[int] = NODE_LIMIT,
+                 strictness: str = "standard") -> PackedResult:
+    """
+    Searches a single shard produced by prepare_parallel_search(...) in "best" mode, skipping any partial crosswords
+    that belong to another shard. Intended to be run in a worker process.
+    :param shard: Shard to search.
+    :param shards: Every shard of the split search.
+    :param bound: Score of the worst of the best grids found so far (by the probe and other shards), if known. Only
+        grids better than this are searched for.
+    :param deadline: Time (as given by time.time(), which unlike time.monotonic() can be compared between processes)
+        after which to stop searching.
+    :param node_limit: Number of partial crosswords after which to stop searching this shard.
+    :param strictness: One of STRICTNESS_LEVELS (the same as for prepare_parallel_search(...)).
+    :return: Result for the shard, packed with pack_result(...) (for the words of every shard).
+    """
+    os.nice(10)
+    placed, words_to_add = shard
+    crossword = Crossword([Word(*word) for word in placed])
+    if deadline is not None:
+        deadline = time.monotonic() + (deadline - time.time())
+
+    search = Search(TRANSPOSE_SYMMETRY, deadline=deadline, node_limit=node_limit, strictness=strictness,
+                    forward_checking=FORWARD_CHECKING)
+    search.restrict_to_shard(placed, [root for root, _ in shards])
+    search.bound = bound
+    result = search_grids(words_to_add, "best", crossword, search)
+    return pack_result(result, [word for word, _, _, _ in placed] + words_to_add)
+
 
-    output.append(f"{len(crosswords)} unique grids found...\n")
-    json_data["num_grids"] = len(crosswords)
+def merge_results(results: List[SearchResult]) -> SearchResult:
+    """
+    Merges the results of searching each of the shards of a search (and the probe, if any), removing grids found more
+    than once.
+    :param results: List of SearchResults.
+    :return: SearchResult for the whole search. Since shards find many of the same grids as the probe (and each other),
+        only the distinct grids among those returned are counted (so the count isn't exact).
+    """
+    best = BestGrids(MAX_GRIDS_RETURNED)
+    seen = set()
+    warnings = []
+    for result in results:
+        for xw in result.grids:
+            key = xw.canonical_key(TRANSPOSE_SYMMETRY)
+            if key not in seen:
+                seen.add(key)
+                best.add(xw)
+        warnings += [warning for warning in result.warnings if warning not in warnings]
+
+    infeasible = next((result.infeasible for result in results if result.infeasible is not None), None)
+    return SearchResult(best.grids(), len(seen), warnings, any(result.partial for result in results), infeasible,
+                        num_grids_exact=False)
+
+
+def grid_json(crossword: Crossword, compact: bool = False) -> Dict[str, Any]:
+    """
+    Returns a grid in the form used by the builder UI, with the grid centred in its own bounding square. The crossword
+    itself is left as it is.
+    :param crossword: Valid crossword.
+    :param compact: If True, each clue is given as a [word, row, col, direction] list, rather than a dictionary with
+        those keys.
+    """
+    crossword = Crossword(list(crossword.words))
+    crossword.centre()
+    clues = crossword.list_clues()
+    if compact:
+        clues = [[clue["word"], clue["row"], clue["col"], clue["direction"]] for clue in clues]
+    return {
+        "clues": clues,
+        "grid_size": max(crossword.get_bounding_box())
+    }
+
+
+def render_result(wordlist: List[str], result: SearchResult, json: bool,
+                  compact: bool = False) -> Union[str, Dict[str, Any]]:
+    """
+    Renders a search result, either as JSON data (for the builder UI) or as text. Only the format asked for is built.
+    :param compact: Whether to encode JSON grids compactly (see grid_json(...)).
+    """
+    if json:
+        return result_json(result, compact)
+    return result_text(wordlist, result)
+
+
+def result_json(result: SearchResult, compact: bool = False) -> Dict[str, Any]:
+    json_data = {"errors": [], "warnings": result.warnings.copy(), "grids": [], "partial": result.partial,
+                 "num_grids": result.num_grids, "num_grids_exact": result.num_grids_exact}
 
-    if len(crosswords) == 0:
-        output.append(f"There are no connected crosswords using the words {wordlist}.")
+    if result.num_grids == 0:
         json_data["errors"].append("no_grids_found")
+        if result.infeasible is not None:
+            json_data["errors"].append("words_cannot_connect")
+            json_data["message"] = result.infeasible
+    else:
+        json_data["grids"] = [grid_json(xw, compact) for xw in result.grids]
+
+    return json_data
+
+
+def result_text(wordlist: List[str], result: SearchResult) -> str:
+    output = []
 
+    if "iteration_limit_reached" in result.warnings:
+        output.append("Warning! Iteration limit reached!")
+    if result.partial:
+        output.append("Warning! Search stopped early; showing the best grids found so far.")
+
+    if result.num_grids_exact:
+        output.append(f"{result.num_grids} unique grids found...\n")
     else:
+        output.append(f"{result.num_grids} unique grids found (not counting grids skipped for being worse)...\n")
 
-        # Maximise number of crossings, then minimise size, and minimise aspect ratio...
-        crosswords = sorted(crosswords,
-                            key=lambda xw: (-xw.count_crossings(), xw.get_size(), xw.get_aspect_ratio()))
-        
+    if result.num_grids == 0:
+        if result.partial:
+            output.append(f"No connected crosswords using the words {wordlist} were found in time.")
+        else:
+            output.append(f"There are no connected crosswords using the words {wordlist}.")
+        if result.infeasible is not None:
+            output.append(result.infeasible)
+
+    else:
         output.append("Best grid(s):")
-        best_grids = crosswords[:MAX_GRIDS_RETURNED]
-        for xw in best_grids:
+        for xw in result.grids:
             output.append(xw.display_string())
             output.append(xw.list_clues_string())
             output.append("")
 
-            xw.centre()
+    return "\n".join(output)
 
-            json_data["grids"].append({
-                "clues": xw.list_clues(),
-                "grid_size": max(xw.get_bounding_box())
-            })
 
-    if json:
-        return json_data
-    return "\n".join(output)
+def main(wordlist: List[str], json: bool, mode: str = "enumerate", time_limit: Optional[float] = TIME_LIMIT,
+         node_limit: Optional[int] = NODE_LIMIT, strictness: str = "standard",
+         engine: str = "exhaustive") -> Union[str, Dict[str, Any]]:
+    os.nice(10)
+    deadline = None if time_limit is None else time.monotonic() + time_limit
+    search = Search(TRANSPOSE_SYMMETRY, deadline=deadline, node_limit=node_limit, strictness=strictness,
+                    forward_checking=FORWARD_CHECKING)
+    if engine == "greedy":
+        result = greedy_search(wordlist, search)
+    else:
+        result = search_grids(wordlist, mode, search=search)
+    return render_result(wordlist, result, json)
 
 
 class BadRequest(Exception):
@@ -384,15 +1613,47 @@ class BadRequest(Exception):
 MAX_WORDS = 5
 MAX_WORD_LENGTH = 20
 
-@timeout(TIME_LIMIT, timeout_exception=TimeoutError)
-def process_generate_request(wordlist: List[str], json=False) -> str:
-    if len(wordlist) > MAX_WORDS:
-        raise BadRequest(f"Too many words! (maximum of {MAX_WORDS})")
+def validate_generate_request(wordlist: List[str], mode: str = "enumerate", strictness: str = "standard",
+                              engine: str = "exhaustive") -> None:
+    if mode not in SEARCH_MODES:
+        raise BadRequest(f"Unknown search mode '{mode}'! (choose from {', '.join(SEARCH_MODES)})")
+
+    if strictness not in STRICTNESS_LEVELS:
+        raise BadRequest(f"Unknown strictness '{strictness}'! (choose from {', '.join(STRICTNESS_LEVELS)})")
+
+    if engine not in ENGINES:
+        raise BadRequest(f"Unknown engine '{engine}'! (choose from {', '.join(ENGINES)})")
+
+    max_words = MAX_GREEDY_WORDS if engine == "greedy" else MAX_WORDS
+    if len(wordlist) > max_words:
+        raise BadRequest(f"Too many words! (maximum of {max_words} for the {engine} engine)")
     
     if any(len(word) > MAX_WORD_LENGTH for word in wordlist):
         raise BadRequest(f"Words too long! (max length {MAX_WORD_LENGTH})")
-        
-    return main(wordlist, json)
+
+
+def process_generate_request(wordlist: List[str], mode="enumerate", strictness="standard", engine="exhaustive",
+                             queue=None) -> PackedResult:
+    """
+    Handles a /quizdle-builder/generate request. Intended to be run in a worker process: the result is returned packed
+    (see pack_result(...)), to be rendered by the caller with render_result(...).
+    :param queue: Optional queue (e.g. from a multiprocessing.Manager) to stream grids through as they are found. Each
+        grid better than those before it is put on the queue as {"type": "grid", "grid": pack_grid(...)}.
+    :return: PackedResult
+    """
+    validate_generate_request(wordlist, mode, strictness, engine)
+    os.nice(10)
+    search = Search(TRANSPOSE_SYMMETRY, deadline=time.monotonic() + TIME_LIMIT, node_limit=NODE_LIMIT,
+                    strictness=strictness, forward_checking=FORWARD_CHECKING)
+    on_improvement = None
+    if queue is not None:
+        on_improvement = lambda xw: queue.put({"type": "grid", "grid": pack_grid(xw, wordlist)})
+
+    if engine == "greedy":
+        result = greedy_search(wordlist, search, on_improvement)
+    else:
+        result = search_grids(wordlist, mode, search=search, on_improvement=on_improvement)
+    return pack_result(result, wordlist)
 
 
 if __name__ == '__main__':
@@ -400,4 +1661,4 @@ if __name__ == '__main__':
     wordlist = ["AAAAAAAAAA", "AAAAAAAAAA", "AAAAAAAAAA", "AAAAAAAAAA", "AAAAAAAAAA"]
 
     # output = main(wordlist)
-    # print(output)
\ No newline at end of file
+    # print(output)
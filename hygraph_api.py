@@ -1,43 +1,178 @@
+"""
+HYGRAPH_API.PY
 
-from typing import Dict, Any, List
+Queries and mutations of Quizdles in the Hygraph CMS. Each function has an async version (named ..._async), for use in
+the server, which sends its requests over a single shared aiohttp session so that connections to the CMS are kept alive
+and reused. The sync versions are thin wrappers for use in scripts.
 
-import requests
+The results of queries are cached for a while (see QueryCache), since Quizdles only change when they are written with
+write_new_quizdle(...), which clears the results it affects.
+
+"""
+
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple, Hashable
+
+import aiohttp
+import asyncio
 import json
+import time
 
+from contextvars import ContextVar
 from datetime import date, timedelta
-from random import randint
+from functools import partial
 
 from authentication import authetnicate, AuthenticationError
 
+# (May be pointed at a local fake GraphQL server for testing.)
 CMS_API_URL = "https://api-eu-west-2.hygraph.com/v2/cl2kgfyvs0dme01xrcdjta9z4/master"
+AUTH_TOKEN_PATH = "private/auth_token"
 
-AUTH_TOKEN = open("private/auth_token").read()
+# Number of connections to the CMS that may be open at once...
+MAX_CONNECTIONS = 4
+# ...and how many seconds each request may take.
+CMS_TIMEOUT = 10
+
+# How many seconds the results of each kind of query are cached for. (Writes through write_new_quizdle(...) clear the
+# results they affect straight away, so these only matter for changes made in the CMS itself.)
+QUIZDLE_TTL = 3600
+WEEK_STATUS_TTL = 300
 
 # Date of the First Quizdle
 START_DATE = "2022-05-08"
+# Number of days after its start date covered by get_week_status(...).
+WEEK_LENGTH = 7
+# Number of Quizdles to fetch per query when exporting them all (the most the CMS returns at once).
+EXPORT_PAGE_SIZE = 100
+# Number of Quizdles to write per request when writing several at once (see write_quizdles_async(...))...
+WRITE_BATCH_SIZE = 7
+# ...and how many of those requests may be in progress at once.
+MAX_CONCURRENT_WRITES = 2
 
+# Session shared by every request to the CMS, created when first needed (see get_session())...
+session: Optional[aiohttp.ClientSession] = None
+# ...except those made by a sync wrapper, which uses a session of its own in its own event loop (see run_sync(...)).
+own_session: ContextVar[Optional[aiohttp.ClientSession]] = ContextVar("own_session", default=None)
 
-class BearerToken(requests.auth.AuthBase):
-    def __init__(self, token: str):
-        self.token = token
-    def __call__(self, r: requests.Request):
-        r.headers["authorization"] = "Bearer " + self.token
-        return r
-    
 
 class QueryException(Exception):
     """Exceptions raised when errors occur in queries."""
 
 
-def query_CMS(query: str, **variables) -> Dict[str, Any]:
+class QueryCache:
+    """
+    In-memory cache of the results of queries, each kept for a given time. If a result is needed while it's already
+    being fetched, the fetch is shared rather than repeated.
+    """
+
+    def __init__(self):
+        # (Time the result expires, as given by time.monotonic(), result) by key.
+        self.entries: Dict[Hashable, Tuple[float, Any]] = {}
+        # Fetches currently running, by key.
+        self.in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Looks up a cached result, fetching it if it isn't cached (or has expired).
+        :param key: Key identifying the query.
+        :param ttl: Number of seconds to keep a fetched result for.
+        :param fetch: Coroutine function that runs the query.
+        :return: Result of the query.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self.in_flight[key] = future
+            future.add_done_callback(partial(self._fetched, key, ttl))
+        # Shielded, so that one caller giving up doesn't cancel the fetch for everyone else.
+        return await asyncio.shield(future)
+
+    def _fetched(self, key: Hashable, ttl: float, future: asyncio.Future) -> None:
+        # If the key was invalidated while fetching, the result may already be out of date, so don't keep it.
+        if self.in_flight.get(key) is not future:
+            return
+        del self.in_flight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.entries[key] = time.monotonic() + ttl, future.result()
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> None:
+        """
+        Removes every result (including any being fetched) whose key satisfies predicate.
+        """
+        for key in [key for key in self.entries if predicate(key)]:
+            del self.entries[key]
+        for key in [key for key in self.in_flight if predicate(key)]:
+            del self.in_flight[key]
+
+
+query_cache = QueryCache()
+
+
+def new_session() -> aiohttp.ClientSession:
+    with open(AUTH_TOKEN_PATH, "r") as f:
+        auth_token = f.read()
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS),
+        timeout=aiohttp.ClientTimeout(total=CMS_TIMEOUT),
+        headers={"authorization": "Bearer " + auth_token, "gcms-stage": "PUBLISHED"}
+    )
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the session to send requests to the CMS with: that of the sync wrapper being run, if any (see
+    run_sync(...)), and otherwise the shared session, creating it if necessary. Must be called from within the event
+    loop the session is to be used in.
+    """
+    global session
+    if own_session.get() is not None:
+        return own_session.get()
+    if session is None or session.closed:
+        session = new_session()
+    return session
+
+
+async def close_session() -> None:
+    global session
+    if session is not None:
+        await session.close()
+        session = None
+
+
+def run_sync(function: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+    """
+    Runs one of the async functions to completion from synchronous code, in an event loop and with a session of its
+    own, so that the shared session is left alone (even if it's open, e.g. in the server).
+    """
+    async def run():
+        async with new_session() as session:
+            own_session.set(session)
+            return await function(*args, **kwargs)
+
+    return asyncio.run(run())
+
+
+async def post_CMS(query: str, **variables) -> Dict[str, Any]:
+    """
+    Sends a query to the CMS.
+    :return: The whole response, which may have both "data" and "errors" (e.g. if some of several mutations failed).
+    """
     payload = {"query": query, "variables": variables}
 
-    response = requests.post(
-        CMS_API_URL,
-        auth=BearerToken(AUTH_TOKEN),
-        json=payload,
-        headers={"gcms-stage": "PUBLISHED"}
-    ).json()
+    async with get_session().post(CMS_API_URL, json=payload) as response:
+        # Errors come back as JSON too, whatever the status.
+        return await response.json(content_type=None)
+
+
+async def query_CMS_async(query: str, **variables) -> Dict[str, Any]:
+    response = await post_CMS(query, **variables)
 
     if "errors" in response:
         error_messages = [error["message"] for error in response["errors"]]
@@ -46,6 +181,10 @@ def query_CMS(query: str, **variables) -> Dict[str, Any]:
     return response.get("data")
 
 
+def query_CMS(query: str, **variables) -> Dict[str, Any]:
+    return run_sync(query_CMS_async, query, **variables)
+
+
 def parse_quizdle(quizdle: Dict[str, Any]) -> Dict[str, Any]:
     quiz = quizdle.get("quiz")
 
@@ -68,7 +207,7 @@ def parse_quizdle(quizdle: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def get_quizdle_by_date(date: str):
+async def fetch_quizdle_by_date(date: str):
     query = """query FetchTodaysQuizdle {
         quizdles(where: {quiz: {date: "$DATE"} }) {
             quiz {
@@ -82,7 +221,7 @@ def get_quizdle_by_date(date: str):
 
     # TODO: replace this with a GraphQL variable
     query = query.replace("$DATE", date)
-    response = query_CMS(query)
+    response = await query_CMS_async(query)
     quizdles = response.get("quizdles")
     
     if not quizdles:
@@ -92,22 +231,15 @@ def get_quizdle_by_date(date: str):
     return parse_quizdle(quizdle)
 
 
-def get_random_quizdle():
-    
-    start_date = date.fromisoformat(START_DATE)
-    max_diff = (date.today() - start_date).days - 1
-        
-    random_quizdle = None
-    while random_quizdle is None:
-        diff = randint(0, max_diff)
-        random_date = str(start_date + timedelta(days=diff))
-        random_quizdle = get_quizdle_by_date(random_date)
-    
-    print(f"Quizlde #{diff} ({random_date})")
-    return random_quizdle
+async def get_quizdle_by_date_async(date: str):
+    return await query_cache.get(("quizdle", date), QUIZDLE_TTL, partial(fetch_quizdle_by_date, date))
 
 
-def get_week_status(start_date: str) -> List[str]:
+def get_quizdle_by_date(date: str):
+    return run_sync(get_quizdle_by_date_async, date)
+
+
+async def fetch_week_status(start_date: str) -> List[str]:
     # Returns the dates that have quizdle for those in the next week after and including start_date.
     query = """query GetQuizdlesBetween($start_date: Date, $end_date: Date) {
         quizdles(where: {quiz: {date_gte: $start_date, date_lte: $end_date}}) {
@@ -117,48 +249,208 @@ def get_week_status(start_date: str) -> List[str]:
         }
     }
     """
-    end_date = str(date.fromisoformat(start_date) + timedelta(days=7))
-    response = query_CMS(query, start_date=start_date, end_date=end_date)
+    end_date = str(date.fromisoformat(start_date) + timedelta(days=WEEK_LENGTH))
+    response = await query_CMS_async(query, start_date=start_date, end_date=end_date)
     dates = [quizdle["quiz"]["date"] for quizdle in response["quizdles"]]
     return dates
 
 
-def write_new_quizdle(quizdle: Dict[str, Any]) -> Dict[str, Any]:
-    create_query = """mutation createNewQuizdle($data: QuizdleCreateInput!) {
-        createQuizdle(data: $data) {
-            id
+async def fetch_quizdles_between(start_date: str, end_date: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetches every Quizdle between two dates (inclusive), a page at a time.
+    :param start_date: First date, in ISO format.
+    :param end_date: Last date, in ISO format.
+    :return: Dictionary of each Quizdle found (parsed as by parse_quizdle(...)) by date.
+    """
+    query = """query ExportQuizdles($start_date: Date, $end_date: Date, $first: Int, $skip: Int) {
+        quizdles(where: {quiz: {date_gte: $start_date, date_lte: $end_date}}, first: $first, skip: $skip) {
             quiz {
-                id
+                date,
+                clue1, clue2, clue3, clue4, clue5,
+                answer1, answer2, answer3, answer4, answer5,
+                rowCol1, rowCol2, rowCol3, rowCol4, rowCol5
             }
         }
     }
     """
-    publish_query = """mutation publishExistingQuizdle($id: ID!) {
-        publishQuizdle(where: {id: $id}) {
-            id
+    quizdles = {}
+    skip = 0
+    while True:
+        response = await query_CMS_async(query, start_date=start_date, end_date=end_date, first=EXPORT_PAGE_SIZE,
+                                         skip=skip)
+        page = response["quizdles"]
+        for quizdle in page:
+            quizdles[quizdle["quiz"]["date"]] = parse_quizdle(quizdle)
+        if len(page) < EXPORT_PAGE_SIZE:
+            return quizdles
+        skip += EXPORT_PAGE_SIZE
+
+
+async def get_week_status_async(start_date: str) -> List[str]:
+    return await query_cache.get(("week_status", start_date), WEEK_STATUS_TTL, partial(fetch_week_status, start_date))
+
+
+def get_week_status(start_date: str) -> List[str]:
+    return run_sync(get_week_status_async, start_date)
+
+
+def invalidate_date(quizdle_date: str) -> None:
+    """
+    Clears the cached results of every query that covers a date, after the Quizdle for that date has changed.
+    """
+    try:
+        changed = date.fromisoformat(quizdle_date)
+    except (TypeError, ValueError):
+        # Only a query for the Quizdle with exactly this "date" could have been affected.
+        changed = None
+
+    def affected(key: Hashable) -> bool:
+        kind, key_date = key
+        if kind == "quizdle":
+            return key_date == quizdle_date
+        # A week status query covers its start date and the WEEK_LENGTH days after.
+        return changed is not None and 0 <= (changed - date.fromisoformat(key_date)).days <= WEEK_LENGTH
+
+    query_cache.invalidate(affected)
+
+
+async def write_quizdle_batch(quizdles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Creates and publishes several Quizdles in two requests: one with a createQuizdle mutation (under its own alias) for
+    each Quizdle, then one publishing all those created. (A Quizdle can't be published until it has been created,
+    since it's published by its id.) If the whole request is rejected, the Quizdles are written one at a time instead.
+    :param quizdles: Quizdles to write.
+    :return: Result of writing each Quizdle, in order, as {"date": date, "success": bool}, with an "error" message if
+        it failed.
+    """
+    # Quizdles whose date isn't a date (as YYYY-MM-DD) fail without being sent, and the rest are written as usual.
+    date_errors = {}
+    for i, quizdle in enumerate(quizdles):
+        if "date" in quizdle:
+            try:
+                valid = str(date.fromisoformat(quizdle["date"])) == quizdle["date"]
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                date_errors[i] = f"Invalid date {quizdle['date']!r} (expected YYYY-MM-DD)"
+    if date_errors:
+        valid_quizdles = [quizdle for i, quizdle in enumerate(quizdles) if i not in date_errors]
+        valid_results = iter(await write_quizdle_batch(valid_quizdles) if valid_quizdles else [])
+        return [{"date": quizdle["date"], "success": False, "error": date_errors[i]} if i in date_errors
+                else next(valid_results) for i, quizdle in enumerate(quizdles)]
+
+    definitions = ", ".join(f"$data{i}: QuizdleCreateInput!" for i in range(len(quizdles)))
+    mutations = "\n".join(f"create{i}: createQuizdle(data: $data{i}) {{ id }}" for i in range(len(quizdles)))
+    create_query = f"mutation createNewQuizdles({definitions}) {{\n{mutations}\n}}"
+    publish_query = """mutation publishExistingQuizdles($ids: [ID!], $first: Int) {
+        publishManyQuizdlesConnection(where: {id_in: $ids}, first: $first) {
+            edges {
+                node {
+                    id
+                }
+            }
         }
     }"""
 
-    response = query_CMS(create_query, data={"quiz": {"create": quizdle}})
+    results = [{"date": quizdle.get("date"), "success": False} for quizdle in quizdles]
+    try:
+        response = await post_CMS(create_query, **{f"data{i}": {"quiz": {"create": quizdle}}
+                                                   for i, quizdle in enumerate(quizdles)})
+        # Errors are attributed to the mutation (by alias) they came from, where possible.
+        errors: Dict[Optional[str], List[str]] = {}
+        for error in response.get("errors", []):
+            errors.setdefault((error.get("path") or [None])[0], []).append(error["message"])
+
+        created = {}
+        for i, result in enumerate(results):
+            quizdle_id = ((response.get("data") or {}).get(f"create{i}") or {}).get("id")
+            if quizdle_id is None:
+                result["error"] = "\n".join(errors.get(f"create{i}") or errors.get(None) or ["Not created"])
+            else:
+                created[quizdle_id] = result
+
+        # Errors that don't come from any one mutation (e.g. a Quizdle that isn't a valid QuizdleCreateInput) reject
+        # the whole request, so write the Quizdles one at a time to find out which of them failed.
+        if not created and None in errors and len(quizdles) > 1:
+            return [result for quizdle in quizdles for result in await write_quizdle_batch([quizdle])]
+
+        if created:
+            data = await query_CMS_async(publish_query, ids=list(created), first=len(created))
+            published = {edge["node"]["id"] for edge in data["publishManyQuizdlesConnection"]["edges"]}
+            for quizdle_id, result in created.items():
+                if quizdle_id in published:
+                    result["success"] = True
+                else:
+                    result["error"] = "Created but not published"
+
+    except Exception as e:
+        for result in results:
+            if not result["success"] and "error" not in result:
+                result["error"] = f"{type(e).__name__}: {e}"
+
+    finally:
+        # Even if the write failed part way through, the Quizdles may have changed.
+        for quizdle in quizdles:
+            if "date" in quizdle:
+                invalidate_date(quizdle["date"])
+
+    return results
+
+
+async def write_quizdles_async(quizdles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Creates and publishes several Quizdles (e.g. a week's worth), in batches of WRITE_BATCH_SIZE, with up to
+    MAX_CONCURRENT_WRITES batches being written at once.
+    :param quizdles: Quizdles to write.
+    :return: Result of writing each Quizdle, in order (see write_quizdle_batch(...)).
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_WRITES)
+
+    async def write_batch(batch):
+        async with semaphore:
+            return await write_quizdle_batch(batch)
+
+    batches = [quizdles[i:i + WRITE_BATCH_SIZE] for i in range(0, len(quizdles), WRITE_BATCH_SIZE)]
+    results = await asyncio.gather(*[write_batch(batch) for batch in batches])
+    return [result for batch_results in results for result in batch_results]
+
+
+def write_quizdles(quizdles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return run_sync(write_quizdles_async, quizdles)
 
-    quizlde_id = response["createQuizdle"]["id"]
 
-    response = query_CMS(publish_query, id=quizlde_id)
+async def write_new_quizdle_async(quizdle: Dict[str, Any]) -> Dict[str, Any]:
+    result, = await write_quizdle_batch([quizdle])
+    if not result["success"]:
+        raise QueryException(result["error"])
 
     return {"success": True}
 
 
+def write_new_quizdle(quizdle: Dict[str, Any]) -> Dict[str, Any]:
+    return run_sync(write_new_quizdle_async, quizdle)
 
-def perform_query(query_type: str, **kwargs) -> Any:
+
+async def perform_query_async(query_type: str, **kwargs) -> Any:
     match query_type:
         case "get_week_status":
-            return get_week_status(**kwargs)
+            return await get_week_status_async(**kwargs)
         
         case "write_new_quizdle":
             authetnicate(kwargs.get("password"), "private/quizdle_verifier")
             
             quizdle = json.loads(kwargs.get("quizdle"))
-            return write_new_quizdle(quizdle)
+            return await write_new_quizdle_async(quizdle)
+
+        case "write_quizdles":
+            authetnicate(kwargs.get("password"), "private/quizdle_verifier")
+
+            quizdles = json.loads(kwargs.get("quizdles"))
+            return {"results": await write_quizdles_async(quizdles)}
+
+
+def perform_query(query_type: str, **kwargs) -> Any:
+    return run_sync(perform_query_async, query_type, **kwargs)
 
 
 # Room for doing some testing...
@@ -1,9 +1,14 @@
 
+// Whether grids are being built; the spinner stops as soon as the first grid is shown, but the search carries on.
+let building = false;
+
 $(".build-btn").on("click", async function () {
+    // Ignore further clicks while grids are already being built.
+    if (building) {
+        return;
+    }
     console.log("Starting grid-building process...");
     
-    // Tidy up possible interruptions...
-    $(this).removeClass("spin");
     $(".error-msg").fadeOut();
 
     let words = [];
@@ -25,8 +30,19 @@ $(".build-btn").on("click", async function () {
     }
 
     $(this).addClass("spin");
-
-    const data = await get_crossword_grids(words);
+    building = true;
+
+    // Show each better grid as soon as it's found, while the search carries on.
+    let data;
+    try {
+        data = await stream_crossword_grids(words, function (grid) {
+            $(".grid .row").remove();
+            display_grid(grid);
+        });
+    } catch (e) {
+        data = "The request failed: " + e;
+    }
+    building = false;
 
     console.log("Recieved data: ", data);
 
@@ -35,7 +51,7 @@ $(".build-btn").on("click", async function () {
     if (typeof data == "string") {
         error = data;
     } else if (data.errors) {
-        error = data.errors.join(", ");
+        error = data.message || data.errors.join(", ");
     }
 
     if (error) {
@@ -60,6 +76,8 @@ $(".build-btn").on("click", async function () {
 
     const grid = data.grids[0];
 
+    // Replace any grid shown while the search was running.
+    $(".grid .row").remove();
     display_grid(grid);
 
     // Activate the other buttons
@@ -1,16 +1,61 @@
 
-async function get_crossword_grids(words) {
-    // Sends a list of string (words) to the /generate endpoint to obtain a complete grid.
-    console.log("Sending request to generate grid for " + words);
-    const result = await $.ajax({
-        url: "https://pi.nicyelland.com/quizdle-builder/generate",
-        data: {
-            words: words.join(","),
-            json: "true"
-        }
+function expand_grid(grid) {
+    // Grids are requested in the compact encoding, with each clue as a [word, row, col, direction] list; this turns
+    // the clues back into objects.
+    return {
+        clues: grid.clues.map(([word, row, col, direction]) => ({word, row, col, direction})),
+        grid_size: grid.grid_size
+    };
+}
+
+async function stream_crossword_grids(words, on_grid) {
+    // Sends a list of strings (words) to the /generate-stream endpoint to obtain the best grids, searched for across
+    // the whole pool: on_grid is called with each better grid as soon as it's found, and the final result is returned
+    // once the search is done.
+    console.log("Sending request to stream grids for " + words);
+    const params = new URLSearchParams({
+        words: words.join(","),
+        mode: "best",
+        parallel: "true",
+        compact: "true"
     });
+    const response = await fetch("https://pi.nicyelland.com/quizdle-builder/generate-stream?" + params);
+
+    const content_type = response.headers.get("Content-Type") || "";
+    if (!response.ok || !content_type.startsWith("application/x-ndjson")) {
+        // Errors are returned as plain text.
+        return await response.text();
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    while (true) {
+        const {value, done} = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, {stream: true});
+
+        let lines = buffer.split("\n");
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (!line) {
+                continue;
+            }
+            const message = JSON.parse(line);
+            if (message.type == "grid") {
+                on_grid(expand_grid(message.grid));
+            } else if (message.type == "done") {
+                message.grids = message.grids.map(expand_grid);
+                return message;
+            } else if (message.type == "error") {
+                return message.error;
+            }
+        }
+    }
 
-    return result;
+    return "The connection closed before the search finished.";
 }
 
 async function get_next_weeks_quizdles_status(date = new Date()) {
@@ -0,0 +1,142 @@
+"""
+QUIZDLE_MIRROR.PY
+
+Local copy of every Quizdle in the CMS, kept in an SQLite database so that Quizdles can be read without a round-trip
+to the CMS (and while it's slow or unreachable). The whole archive is exported from the CMS the first time, and after
+that only recent and upcoming dates are synced.
+
+"""
+
+from typing import Any, Dict, List, Optional
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+
+from hygraph_api import fetch_quizdles_between, get_quizdle_by_date_async, START_DATE, WEEK_LENGTH
+
+# How many seconds to wait between syncs with the CMS.
+SYNC_INTERVAL = 3600
+# Number of days before the last sync to sync again, in case recent Quizdles were changed in the CMS since.
+SYNC_OVERLAP_DAYS = 7
+
+
+class QuizdleMirror:
+
+    def __init__(self, path: str):
+        """
+        :param path: Path of the SQLite database file (created if necessary).
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS quizdles (date TEXT PRIMARY KEY, quizdle TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sync (id INTEGER PRIMARY KEY CHECK (id = 0), "
+                        "synced_until TEXT NOT NULL)")
+        self.db.commit()
+
+        # Sorted dates of every Quizdle in the mirror.
+        self.dates: List[str] = [row[0] for row in self.db.execute("SELECT date FROM quizdles ORDER BY date")]
+
+    def get(self, quizdle_date: str) -> Optional[Dict[str, Any]]:
+        """
+        :param quizdle_date: Date in ISO format.
+        :return: The Quizdle for the date (as given by parse_quizdle(...)), or None if the mirror doesn't have one.
+        """
+        row = self.db.execute("SELECT quizdle FROM quizdles WHERE date = ?", (quizdle_date,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def store(self, quizdles: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Adds (or replaces) Quizdles in the mirror.
+        :param quizdles: Dictionary of Quizdles (as given by parse_quizdle(...)) by date.
+        :return: None
+        """
+        self.db.executemany("INSERT OR REPLACE INTO quizdles (date, quizdle) VALUES (?, ?)",
+                            [(quizdle_date, json.dumps(quizdle)) for quizdle_date, quizdle in quizdles.items()])
+        self.db.commit()
+        for quizdle_date in quizdles:
+            i = bisect_left(self.dates, quizdle_date)
+            if i == len(self.dates) or self.dates[i] != quizdle_date:
+                insort(self.dates, quizdle_date)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def synced_until(self) -> Optional[str]:
+        row = self.db.execute("SELECT synced_until FROM sync WHERE id = 0").fetchone()
+        return None if row is None else row[0]
+
+    async def sync(self) -> int:
+        """
+        Fetches the Quizdles from the CMS that may have changed since the last sync: every Quizdle the first time, and
+        after that those from shortly before the last sync up to a week ahead (since Quizdles are written in advance).
+        :return: Number of Quizdles fetched.
+        """
+        today = date.today()
+        synced_until = self.synced_until()
+        if synced_until is None:
+            start_date = START_DATE
+        else:
+            start_date = str(date.fromisoformat(synced_until) - timedelta(days=SYNC_OVERLAP_DAYS))
+        end_date = str(today + timedelta(days=WEEK_LENGTH))
+
+        quizdles = await fetch_quizdles_between(start_date, end_date)
+        self.store(quizdles)
+        # Quizdles for the coming days may still be written, so only count the mirror as synced up to today.
+        self.db.execute("INSERT OR REPLACE INTO sync (id, synced_until) VALUES (0, ?)", (str(today),))
+        self.db.commit()
+        return len(quizdles)
+
+    async def keep_synced(self, interval: float = SYNC_INTERVAL) -> None:
+        """
+        Syncs with the CMS every interval seconds, until cancelled. Failed syncs are reported and retried next time.
+        """
+        while True:
+            try:
+                count = await self.sync()
+                print(f"Synced {count} Quizdles from the CMS ({len(self.dates)} in the mirror).")
+            except Exception as e:
+                print(f"Error while syncing Quizdles from the CMS ({type(e).__name__}): {e}")
+            await asyncio.sleep(interval)
+
+    async def get_quizdle_by_date(self, quizdle_date: str) -> Optional[Dict[str, Any]]:
+        """
+        Looks up the Quizdle for a date in the mirror, falling back on the CMS if the mirror doesn't have it (e.g. if
+        it was written since the last sync).
+        :param quizdle_date: Date in ISO format.
+        :return: The Quizdle (as given by parse_quizdle(...)), or None if there isn't one (or the CMS couldn't be
+            reached to check).
+        """
+        quizdle = self.get(quizdle_date)
+        if quizdle is not None:
+            return quizdle
+
+        try:
+            quizdle = await get_quizdle_by_date_async(quizdle_date)
+        except Exception as e:
+            print(f"Error while fetching the Quizdle for {quizdle_date} from the CMS ({type(e).__name__}): {e}")
+            return None
+        if quizdle is not None:
+            self.store({quizdle_date: quizdle})
+        return quizdle
+
+    def get_random_quizdle(self) -> Optional[Dict[str, Any]]:
+        """
+        Picks a random Quizdle from before today.
+        :return: The Quizdle (as given by parse_quizdle(...)), or None if the mirror has none.
+        """
+        count = bisect_left(self.dates, str(date.today()))
+        if count == 0:
+            return None
+
+        quizdle_date = self.dates[random.randrange(count)]
+        print(f"Quizlde #{(date.fromisoformat(quizdle_date) - date.fromisoformat(START_DATE)).days} ({quizdle_date})")
+        return self.get(quizdle_date)
@@ -0,0 +1,109 @@
+"""
+RESULT_CACHE.PY
+
+Cache of /quizdle-builder/generate responses. Recently used responses are kept in memory, and every response is also
+written to an SQLite database on disk so that they survive server restarts.
+
+"""
+
+from typing import List, Optional
+
+import os
+import sqlite3
+import time
+
+from collections import OrderedDict
+
+CACHE_DIR = "cache"
+MAX_MEMORY_ENTRIES = 256
+MAX_DISK_ENTRIES = 10000
+
+
+class ResultCache:
+
+    def __init__(self, path: str, max_memory_entries: int = MAX_MEMORY_ENTRIES,
+                 max_disk_entries: int = MAX_DISK_ENTRIES):
+        """
+        :param path: Path of the SQLite database file (created if necessary).
+        :param max_memory_entries: Number of responses to keep in memory, evicting the least recently used.
+        :param max_disk_entries: Number of responses to keep on disk, evicting the least recently used.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                        "(key TEXT PRIMARY KEY, body TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.db.commit()
+        # Number of responses on disk (at most; replaced responses are counted again), so that the table is only trimmed
+        # when it might be too big.
+        self.disk_entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+        self.memory: OrderedDict[str, str] = OrderedDict()
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(words: List[str], version: int, **options) -> str:
+        """
+        Returns the cache key for a request. The key doesn't depend on the order or case of the words.
+        :param words: Words in the request.
+        :param version: Version of the code generating the responses, so that old responses aren't used after changes.
+        :param options: Any other request options that affect the response (e.g. output format).
+        :return: Cache key.
+        """
+        option_string = ",".join(f"{name}={value}" for name, value in sorted(options.items()))
+        return f"v{version}|{option_string}|{','.join(sorted(word.upper() for word in words))}"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Looks up a cached response, counting the hit or miss.
+        :param key: Key from ResultCache.make_key(...).
+        :return: Response body, or None if not cached.
+        """
+        body = self.memory.get(key)
+        if body is not None:
+            self.memory.move_to_end(key)
+        else:
+            row = self.db.execute("SELECT body FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                body = row[0]
+                self._remember(key, body)
+                # Responses on disk are only marked as used when they're loaded back into memory, so that hits in
+                # memory don't have to write to disk.
+                self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.db.commit()
+
+        if body is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return body
+
+    def put(self, key: str, body: str) -> None:
+        """
+        Stores a response in memory and on disk.
+        :param key: Key from ResultCache.make_key(...).
+        :param body: Response body.
+        :return: None
+        """
+        self._remember(key, body)
+        self.db.execute("INSERT OR REPLACE INTO results (key, body, last_used) VALUES (?, ?, ?)",
+                        (key, body, time.time()))
+        self.disk_entries += 1
+        if self.disk_entries > self.max_disk_entries:
+            self.db.execute("DELETE FROM results WHERE key NOT IN "
+                            "(SELECT key FROM results ORDER BY last_used DESC LIMIT ?)", (self.max_disk_entries,))
+            self.disk_entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.db.commit()
+
+    def _remember(self, key: str, body: str) -> None:
+        self.memory[key] = body
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
@@ -0,0 +1,144 @@
+"""
+SCHEDULER.PY
+
+Admission control and fair scheduling of jobs (e.g. crossword generation) on a pool of worker processes. Jobs wait in
+a bounded queue per client, and clients take turns to have their next job started whenever a worker becomes free.
+
+"""
+
+from typing import Any, Callable, Deque, Dict, Tuple
+
+import asyncio
+import math
+import time
+
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+from functools import partial
+
+# Weight given to the latest job when updating the average job duration.
+SMOOTHING = 0.2
+
+
+class QueueFull(Exception):
+    """Exception to raise when a job is rejected because too many jobs are already waiting."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many jobs queued; retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+
+    def __init__(self, executor: Executor, num_workers: int, max_queue_depth: int, max_client_queue_depth: int):
+        """
+        :param executor: Pool to run jobs in.
+        :param num_workers: Number of jobs to run at once (i.e. the number of workers in the pool).
+        :param max_queue_depth: Number of jobs that may be waiting (across all clients) before new jobs are rejected.
+        :param max_client_queue_depth: Number of jobs a single client may have waiting before its new jobs are
+            rejected, so that one client can't take up the whole queue.
+        """
+        self.executor = executor
+        self.num_workers = num_workers
+        self.max_queue_depth = max_queue_depth
+        self.max_client_queue_depth = max_client_queue_depth
+
+        # Queue of (job, future for its result, time queued) for each client with jobs waiting, in turn order.
+        self.queues: OrderedDict[str, Deque[Tuple[Callable[[], Any], asyncio.Future, float]]] = OrderedDict()
+        self.queued = 0
+        self.running = 0
+
+        # Statistics for monitoring.
+        self.started = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.average_duration = 1.0
+
+    def submit(self, client: str, job: Callable[[], Any], may_reject: bool = True) -> asyncio.Future:
+        """
+        Queues a job to run in the pool once it's the client's turn.
+        :param client: Identifier of the client (e.g. IP address) the job is for.
+        :param job: Picklable callable to run in the pool.
+        :param may_reject: Whether the job may be rejected if the queue is full. Should be False for jobs that are part
+            of a larger piece of work that has already been admitted.
+        :raises QueueFull: if the queue is full (or the client already has too many jobs in it).
+        :return: Future for the result of the job.
+        """
+        if may_reject and (self.queued >= self.max_queue_depth
+                           or len(self.queues.get(client, ())) >= self.max_client_queue_depth):
+            self.rejected += 1
+            raise QueueFull(self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(client, deque()).append((job, future, time.monotonic()))
+        self.queued += 1
+        self._start_jobs()
+        return future
+
+    async def run(self, client: str, job: Callable[[], Any], may_reject: bool = True) -> Any:
+        """
+        Runs a job in the pool once it's the client's turn, and waits for its result (see FairScheduler.submit(...)).
+        """
+        return await self.submit(client, job, may_reject)
+
+    def retry_after(self) -> int:
+        """
+        Estimates how many seconds it will be until there's room in the queue.
+        """
+        return max(1, math.ceil(self.average_duration * (self.queued + 1) / self.num_workers))
+
+    def _start_jobs(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.running < self.num_workers and self.queues:
+            # Take the next job from the client at the front, then send that client to the back.
+            client, queue = next(iter(self.queues.items()))
+            job, future, queued_at = queue.popleft()
+            if queue:
+                self.queues.move_to_end(client)
+            else:
+                del self.queues[client]
+            self.queued -= 1
+
+            # The client may have given up waiting.
+            if future.cancelled():
+                continue
+
+            wait = time.monotonic() - queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.started += 1
+
+            self.running += 1
+            result = loop.run_in_executor(self.executor, job)
+            result.add_done_callback(partial(self._job_done, future, time.monotonic()))
+
+    def _job_done(self, future: asyncio.Future, started_at: float, result: asyncio.Future) -> None:
+        self.running -= 1
+        duration = time.monotonic() - started_at
+        self.average_duration += SMOOTHING * (duration - self.average_duration)
+
+        if not future.cancelled():
+            if result.exception() is not None:
+                future.set_exception(result.exception())
+            else:
+                future.set_result(result.result())
+        self._start_jobs()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns statistics about the queue, for monitoring. (Only totals are given, not which clients are waiting.)
+        """
+        return {
+            "workers": self.num_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "max_client_queue_depth": self.max_client_queue_depth,
+            "clients_waiting": len(self.queues),
+            "started": self.started,
+            "rejected": self.rejected,
+            "average_wait": self.total_wait / self.started if self.started else 0.0,
+            "max_wait": self.max_wait,
+            "average_duration": self.average_duration
+        }
@@ -1,77 +1,548 @@
 #!/usr/bin/env python
 
 import asyncio
+import ipaddress
+import json
+import mimetypes
+import os
 import socketio
 import ssl
+import time
 import traceback
 
 from aiohttp import web
 from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from datetime import date
-from hashlib import sha3_512
+from hashlib import sha3_512, sha256
+from multiprocessing import Manager
+from queue import Empty
 
 from authentication import authetnicate, AuthenticationError
-from crossword import process_generate_request, BadRequest
-from hygraph_api import get_quizdle_by_date, perform_query
+from crossword import (process_generate_request, validate_generate_request, prepare_parallel_search, search_shard,
+                       merge_results, result_bound, render_result, unpack_result, unpack_grid, grid_json,
+                       Improvements, BadRequest, TIME_LIMIT, ENGINE_VERSION)
+from hygraph_api import perform_query_async, parse_quizdle, close_session, query_cache
+from quizdle_mirror import QuizdleMirror
+from result_cache import ResultCache, CACHE_DIR
+from scheduler import FairScheduler, QueueFull
+from suggestions import suggest_words, load_dictionary, DICTIONARY_PATH
 
-pool = ProcessPoolExecutor(3)
+POOL_SIZE = 3
+# Number of generate jobs that may wait for a worker (across all clients) before further requests are turned away...
+MAX_QUEUE_DEPTH = 12
+# ...and the number any one client may have waiting before its further requests are turned away.
+MAX_CLIENT_QUEUE_DEPTH = 4
+# How often (in seconds) to check whether a streamed generate job has finished, when no grids are arriving.
+STREAM_POLL_INTERVAL = 0.2
+# How often (in seconds) to check whether a static file has changed on disk (e.g. after a deploy).
+STATIC_CHECK_INTERVAL = 1.0
+# How long (in seconds) browsers and Cloudflare may use static assets before checking whether they've changed. Pages
+# are always checked, so that deploys show up straight away; checks are cheap, since unchanged files get a 304.
+STATIC_MAX_AGE = 300
+# Cloudflare's IP ranges (from https://www.cloudflare.com/ips/). The client address Cloudflare passes on is only trusted
+# from these, so that clients connecting directly can't choose their own.
+CLOUDFLARE_NETWORKS = [ipaddress.ip_network(network) for network in [
+    "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22", "141.101.64.0/18", "108.162.192.0/18",
+    "190.93.240.0/20", "188.114.96.0/20", "197.234.240.0/22", "198.41.128.0/17", "162.158.0.0/15", "104.16.0.0/13",
+    "104.24.0.0/14", "172.64.0.0/13", "131.0.72.0/22",
+    "2400:cb00::/32", "2606:4700::/32", "2803:f800::/32", "2405:b500::/32", "2405:8100::/32", "2a06:98c0::/29",
+    "2c0f:f248::/32"
+]]
 
+result_cache = ResultCache(os.path.join(CACHE_DIR, "results.sqlite3"))
+# Generate jobs currently running, by cache key, so that identical requests can share them.
+in_flight = {}
 
-def html_response(path):
-    with open(path, "r") as f:
-        resp = web.Response(text=f.read(), content_type="text/html")
-    return resp
 
+class StaticFile:
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            self.body = f.read()
+        # Files are reloaded if either of these change.
+        self.mtime = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.last_checked = time.monotonic()
+
+        self.etag = sha256(self.body).hexdigest()[:32]
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if self.content_type == "text/html":
+            self.cache_control = "no-cache"
+        else:
+            self.cache_control = f"public, max-age={STATIC_MAX_AGE}"
+
+
+# Static files loaded so far, by path.
+static_files = {}
+
+
+def load_static_file(path):
+    """
+    Returns a static file from memory, loading it from disk if it isn't loaded yet or has changed since (which is
+    checked at most every STATIC_CHECK_INTERVAL seconds). Returns None if there is no such file.
+    """
+    static_file = static_files.get(path)
+    if static_file is not None and time.monotonic() - static_file.last_checked < STATIC_CHECK_INTERVAL:
+        return static_file
+
+    try:
+        stat = os.stat(path)
+        if static_file is not None and (stat.st_mtime_ns, stat.st_size) == (static_file.mtime, static_file.size):
+            static_file.last_checked = time.monotonic()
+            return static_file
+        static_file = static_files[path] = StaticFile(path)
+        return static_file
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        static_files.pop(path, None)
+        return None
+
+
+def static_response(request, path):
+    """
+    Serves a static file (from memory; see load_static_file(...)), with an ETag so that clients can check whether
+    their copy is still up to date, in which case only a 304 is sent.
+    """
+    static_file = load_static_file(path)
+    if static_file is None:
+        return web.Response(status=404, text="404: Not Found")
+
+    headers = {"ETag": f'"{static_file.etag}"', "Cache-Control": static_file.cache_control}
+    if_none_match = request.if_none_match or ()
+    if any(etag.value in (static_file.etag, "*") for etag in if_none_match):
+        return web.Response(status=304, headers=headers)
+
+    charset = "utf-8" if static_file.content_type.startswith("text/") or \
+        static_file.content_type == "application/javascript" else None
+    return web.Response(body=static_file.body, content_type=static_file.content_type, charset=charset,
+                        headers=headers)
+
+
+def static_handler(directory):
+    """
+    Returns a handler serving the static files in a directory (but nothing outside it), with the path from the URL's
+    "path" match.
+    """
+    root = os.path.realpath(directory)
+
+    async def handler(request):
+        path = os.path.realpath(os.path.join(root, request.match_info["path"]))
+        if not path.startswith(root + os.sep):
+            return web.Response(status=404, text="404: Not Found")
+        return static_response(request, path)
+
+    return handler
+
+
+def is_cloudflare(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except (TypeError, ValueError):
+        return False
+    return any(address in network for network in CLOUDFLARE_NETWORKS)
+
+
+def client_address(request):
+    """
+    Returns the IP address of the client making a request, looking past Cloudflare's proxy if the request came through
+    it.
+    """
+    if "CF-Connecting-IP" in request.headers and is_cloudflare(request.remote):
+        return request.headers["CF-Connecting-IP"]
+    return request.remote
+
+
+def parse_words(request):
+    """
+    Returns the words in a request's comma-separated "words" parameter (in upper case), or None if there isn't one.
+    """
+    if request.query.get("words") is None:
+        return None
+    return [w.upper() for w in request.query.get("words").split(",")]
+
+
+def busy_response(e):
+    """
+    Returns the response to a request turned away because the pool is too busy (see QueueFull).
+    """
+    print(f"Server busy; turning request away. {e}")
+    return web.Response(status=503, text="Server busy! Try again shortly.\n",
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+def is_parallel(request, options):
+    """
+    Returns whether a generate request asks for its search to be split across the pool (with parallel=true). Only the
+    "best" search mode of the exhaustive engine can be.
+    """
+    return (request.query.get("parallel") == "true" and options["mode"] == "best"
+            and options["engine"] == "exhaustive")
+
+
+def generate_options(request):
+    """
+    Reads the search options of a generate request from its query string, as keyword arguments for
+    process_generate_request(...).
+    """
+    return {
+        "mode": request.query.get("mode", "enumerate"),
+        "strictness": request.query.get("strictness", "standard"),
+        "engine": request.query.get("engine", "exhaustive")
+    }
+
+
+async def stream_messages(queue, job):
+    """
+    Yields the messages a generate job puts on its queue as they arrive, until the job has finished.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            yield await loop.run_in_executor(None, partial(queue.get, timeout=STREAM_POLL_INTERVAL))
+        except Empty:
+            if job.done():
+                break
+
+    # Anything put on the queue while waiting for the last message is still there.
+    while True:
+        try:
+            yield queue.get_nowait()
+        except Empty:
+            return
+
+
+async def generate_in_parallel(words, strictness, probe, deadline, scheduler, client, on_grid):
+    """
+    Searches for the best grids for a list of words by splitting the search into shards and searching them across the
+    whole pool. Only one shard per worker is submitted at a time, so that each shard can be given the best bound found
+    by the shards before it. Returns the SearchResult for the whole search.
+    :param probe: Awaitable for the result of prepare_parallel_search(...), already submitted to the pool.
+    :param deadline: Time (as given by time.time()) after which to stop searching.
+    :param on_grid: Called with each grid better than those before it, as the probe and each shard finish.
+    """
+    num_workers = scheduler.num_workers
+    improvements = Improvements(on_grid)
+
+    shards, probe = await probe
+    print(f"Searching {len(shards)} shards in parallel.")
+
+    results = []
+
+    def add_results(packed_results):
+        for packed in packed_results:
+            results.append(unpack_result(packed, words))
+            if results[-1].grids:
+                improvements.found(results[-1].grids[0])
+
+    add_results([probe])
+    pending = set()
+    for shard in shards:
+        if len(pending) >= num_workers:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            add_results([future.result() for future in done])
+        bound = result_bound(merge_results(results))
+        # The request has already been admitted, so its shards mustn't be turned away.
+        job = partial(search_shard, shard, shards, bound, deadline, strictness=strictness)
+        pending.add(asyncio.ensure_future(scheduler.run(client, job, may_reject=False)))
+    add_results(await asyncio.gather(*pending))
+
+    return merge_results(results)
+
+
+class GenerateJob:
+    """
+    A generate request being worked on, which is shared by any identical requests made in the meantime (see in_flight).
+    Streamed requests are sent each better grid as it's found (see GenerateJob.grids()).
+    """
+
+    def __init__(self, words, return_json, compact, options, parallel, cache_key):
+        self.words = words
+        self.return_json = return_json
+        self.compact = compact
+        self.options = options
+        self.parallel = parallel
+        self.cache_key = cache_key
+
+        # Best grid found so far, for streamed requests that join part way through.
+        self.best_grid = None
+        # A queue for each streamed request waiting on the job, to pass each better grid on to.
+        self.listeners = []
+        # Task giving the response (as a JSON string), once the job has been started.
+        self.task = None
+
+    def start(self, scheduler, manager, client):
+        """
+        Submits the job to the pool (in the client's turn), and starts waiting for it in the background (see
+        GenerateJob.task). Raises QueueFull if there are already too many jobs waiting for the pool, or BadRequest if
+        the request isn't valid.
+        """
+        if self.parallel:
+            strictness = self.options["strictness"]
+            validate_generate_request(self.words, "best", strictness)
+            deadline = time.time() + TIME_LIMIT
+            queue = manager.Queue()
+            probe = scheduler.submit(client, partial(prepare_parallel_search, self.words, scheduler.num_workers,
+                                                     strictness, queue=queue))
+            probe = self.stream_grids(probe, queue)
+            search = generate_in_parallel(self.words, strictness, probe, deadline, scheduler, client, self.found)
+        else:
+            queue = manager.Queue()
+            future = scheduler.submit(client, partial(process_generate_request, self.words, queue=queue,
+                                                      **self.options))
+            search = self.stream_search(future, queue)
+        self.task = asyncio.ensure_future(self.respond(search))
+
+    async def stream_grids(self, future, queue):
+        """
+        Passes on the grids a job in the pool streams back through its queue, until it has finished. Returns the job's
+        result.
+        """
+        async for message in stream_messages(queue, future):
+            self.found(unpack_grid(message["grid"], self.words))
+        return await future
+
+    async def stream_search(self, future, queue):
+        """
+        Like GenerateJob.stream_grids(...), for a job that returns a (packed) SearchResult.
+        """
+        return unpack_result(await self.stream_grids(future, queue), self.words)
+
+    async def respond(self, search):
+        """
+        Renders the result of the search (see render_result(...)), caching the response if the search was complete.
+        """
+        result = await search
+        body = json.dumps(render_result(self.words, result, self.return_json, self.compact))
+        # A search that was cut short might do better next time, so don't cache it.
+        if not result.partial:
+            result_cache.put(self.cache_key, body)
+        return body
+
+    def found(self, crossword):
+        # A parallel search's probe streams its grids and then returns them too, so skip grids seen already.
+        if self.best_grid is not None and crossword.score() >= self.best_grid.score():
+            return
+        self.best_grid = crossword
+        for listener in self.listeners:
+            listener.put_nowait(crossword)
+
+    async def grids(self):
+        """
+        Yields the best grid found so far (if any), and then each better grid as it's found, until the job has finished.
+        """
+        listener = asyncio.Queue()
+        if self.best_grid is not None:
+            listener.put_nowait(self.best_grid)
+        self.listeners.append(listener)
+        getter = None
+        try:
+            while not (self.task.done() and listener.empty()):
+                getter = asyncio.ensure_future(listener.get())
+                await asyncio.wait({getter, self.task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+        finally:
+            if getter is not None:
+                getter.cancel()
+            self.listeners.remove(listener)
+
+
+def join_generate_job(words, return_json, compact, options, parallel, cache_key, scheduler, manager, client):
+    """
+    Returns the job for a generate request, and whether it was already in progress: if an identical request is already
+    being worked on, its job is shared rather than repeated. Otherwise a new job is started (see GenerateJob.start(...),
+    which may raise QueueFull or BadRequest).
+    """
+    job = in_flight.get(cache_key)
+    if job is not None:
+        print("Identical request already in progress; sharing its result.")
+        return job, True
+
+    job = GenerateJob(words, return_json, compact, options, parallel, cache_key)
+    job.start(scheduler, manager, client)
+    in_flight[cache_key] = job
+    job.task.add_done_callback(lambda _: in_flight.pop(cache_key, None))
+    return job, False
+
+
+async def run_server(port, pool_size=POOL_SIZE, max_queue_depth=MAX_QUEUE_DEPTH,
+                     max_client_queue_depth=MAX_CLIENT_QUEUE_DEPTH):
+    # Load the dictionary before the worker processes are started, so that they share it.
+    dictionary = load_dictionary()
+    if dictionary is None:
+        print(f"No dictionary found at {DICTIONARY_PATH}; answer suggestions will be unavailable.")
+    else:
+        print(f"Loaded dictionary of {len(dictionary)} words for answer suggestions.")
+
+    pool = ProcessPoolExecutor(pool_size)
+    scheduler = FairScheduler(pool, pool_size, max_queue_depth, max_client_queue_depth)
+    # Provides queues that worker processes can stream grids back through.
+    manager = Manager()
+    # Quizdles are read from a local copy, which is kept in sync with the CMS in the background.
+    mirror = QuizdleMirror(os.path.join(CACHE_DIR, "quizdles.sqlite3"))
+    sync_task = asyncio.ensure_future(mirror.keep_synced())
 
-async def run_server(port):
     sio = socketio.AsyncServer(namespaces="*", async_mode="aiohttp")
     app = web.Application()
     sio.attach(app)
+    # When the server stops, stop syncing the mirror (before its connection to the CMS goes), and close the mirror and
+    # the shared connections to the CMS.
+    async def stop_syncing(app):
+        sync_task.cancel()
+        try:
+            await sync_task
+        except asyncio.CancelledError:
+            pass
+        mirror.close()
+
+    app.on_cleanup.append(stop_syncing)
+    app.on_cleanup.append(lambda app: close_session())
 
     routes = web.RouteTableDef()
 
     @routes.get("/")
     async def get_handler(request):
         print("New connection!")
-        return html_response("client/index.html")
+        return static_response(request, "client/index.html")
     
     @routes.get("/quizdle-builder")
     async def get_handler(request):
         print("New connection!")
-        return html_response("quizdle-builder/index.html")
+        return static_response(request, "quizdle-builder/index.html")
         
     # TODO: make this a POST request!
     @routes.get("/quizdle-builder/generate")
     async def post_handler(request: web.Request):
         try:
-            if request.query.get("words") is None:
+            words = parse_words(request)
+            if words is None:
                 return web.Response(text="Submit request by suffixing url with comma-separated list of words, e.g.:" + \
                     "\n\n\t" + \
                     "https://pi.nicyelland.com/quizdle-builder/generate?words=axolotl,bear,canary,dingo,elephant\n")
-            words = [w.upper() for w in request.query.get("words").split(",")]
             print(f"Crossword Generation Request for {words}")
             
             return_json = (request.query.get("json") == "true")
+            # Whether to send JSON grids in the compact encoding (see grid_json(...)).
+            compact = (request.query.get("compact") == "true")
+            options = generate_options(request)
+            parallel = is_parallel(request, options)
 
-            loop = asyncio.get_running_loop()
-            data = await loop.run_in_executor(pool, partial(process_generate_request, json=return_json), words)
+            # The same words (in any order) give the same grids, whether or not the search is run in parallel.
+            cache_key = ResultCache.make_key(words, ENGINE_VERSION, json=return_json, compact=compact, **options)
+            body = result_cache.get(cache_key)
+            cache_status = "HIT"
 
-            print("Returning crossword to client.")
-            return web.json_response(data)
-        
-        except TimeoutError:
-            print("Crossword generation timed out.")
-            return web.Response(text=f"Request timed out! Try using words with fewer letters in common!\n")
+            if body is None:
+                job, coalesced = join_generate_job(words, return_json, compact, options, parallel, cache_key,
+                                                   scheduler, manager, client_address(request))
+                cache_status = "COALESCED" if coalesced else "MISS"
+                # Shielded, so that one client disconnecting doesn't cancel the job for everyone else.
+                body = await asyncio.shield(job.task)
+
+            print(f"Returning crossword to client (cache {cache_status.lower()}).")
+            headers = {
+                "X-Cache": cache_status,
+                "X-Cache-Hits": str(result_cache.hits),
+                "X-Cache-Misses": str(result_cache.misses)
+            }
+            return web.Response(text=body, content_type="application/json", headers=headers)
         
         except BadRequest as e:
             print(f"Error: {e}")
             return web.Response(text=f"Error: {e}\n")
+
+        except QueueFull as e:
+            return busy_response(e)
         
         except Exception as e:
             error_msg = f"Unhandled Error ({type(e).__name__}): {e}\n{''.join(traceback.format_tb(e.__traceback__))}"
             return web.Response(text=error_msg+"\n")
     
+    @routes.get("/quizdle-builder/generate-stream")
+    async def stream_handler(request: web.Request):
+        """
+        Like /quizdle-builder/generate (with json=true), but streams newline-delimited JSON messages: one
+        {"type": "grid", "grid": ...} message each time a better grid is found, then a {"type": "done", ...} message
+        with the same content as the /quizdle-builder/generate response. Also takes compact=true and parallel=true, as
+        for /quizdle-builder/generate, and shares jobs with identical requests to either endpoint.
+        """
+        words = parse_words(request)
+        if words is None:
+            return web.Response(text="Submit request by suffixing url with comma-separated list of words.\n")
+        print(f"Streamed Crossword Generation Request for {words}")
+
+        options = generate_options(request)
+        compact = (request.query.get("compact") == "true")
+        parallel = is_parallel(request, options)
+        try:
+            validate_generate_request(words, **options)
+        except BadRequest as e:
+            print(f"Error: {e}")
+            return web.Response(text=f"Error: {e}\n")
+
+        cache_key = ResultCache.make_key(words, ENGINE_VERSION, json=True, compact=compact, **options)
+        body = result_cache.get(cache_key)
+        cache_status = "HIT"
+        if body is None:
+            try:
+                job, coalesced = join_generate_job(words, True, compact, options, parallel, cache_key, scheduler,
+                                                   manager, client_address(request))
+            except QueueFull as e:
+                return busy_response(e)
+            cache_status = "COALESCED" if coalesced else "MISS"
+
+        response = web.StreamResponse(headers={
+            "Content-Type": "application/x-ndjson",
+            "X-Cache": cache_status
+        })
+        await response.prepare(request)
+
+        if body is None:
+            async for grid in job.grids():
+                message = {"type": "grid", "grid": grid_json(grid, compact)}
+                await response.write((json.dumps(message) + "\n").encode())
+            try:
+                body = await asyncio.shield(job.task)
+            except Exception as e:
+                error = f"Unhandled Error ({type(e).__name__}): {e}"
+                await response.write((json.dumps({"type": "error", "error": error}) + "\n").encode())
+                await response.write_eof()
+                return response
+
+        print("Finished streaming crosswords to client.")
+        await response.write((json.dumps({"type": "done", **json.loads(body)}) + "\n").encode())
+        await response.write_eof()
+        return response
+
+    @routes.get("/quizdle-builder/suggest")
+    async def suggest_handler(request: web.Request):
+        words = parse_words(request)
+        if words is None:
+            return web.Response(text="Submit request by suffixing url with comma-separated list of the answers so far, "
+                                     "e.g.:\n\n\thttps://pi.nicyelland.com/quizdle-builder/suggest?words=axolotl,bear\n")
+        print(f"Answer Suggestion Request for {words}")
+
+        try:
+            data = await scheduler.run(client_address(request), partial(suggest_words, words))
+        except BadRequest as e:
+            print(f"Error: {e}")
+            return web.Response(text=f"Error: {e}\n")
+        except QueueFull as e:
+            return busy_response(e)
+
+        print(f"Returning {len(data['suggestions'])} suggestions to client.")
+        return web.json_response(data)
+
+    @routes.get("/quizdle-builder/status")
+    async def status_handler(request: web.Request):
+        return web.json_response({"pool": scheduler.stats(),
+                                  "cache": {"hits": result_cache.hits, "misses": result_cache.misses},
+                                  "cms_cache": {"hits": query_cache.hits, "misses": query_cache.misses},
+                                  "in_flight": len(in_flight)})
+
     @routes.post("/quizdle-builder/read")
     async def post_handler(request: web.Request):
         payload = await request.post()
@@ -87,22 +558,33 @@ async def run_server(port):
         print("Read request authenticated.")
         if payload.get("today") == "true":
             today = str(date.today())
-            quizdle = get_quizdle_by_date(today)
+            quizdle = await mirror.get_quizdle_by_date(today)
 
             return web.json_response(quizdle)
+
+        if payload.get("random") == "true":
+            return web.json_response(mirror.get_random_quizdle())
     
     @routes.post("/quizdle-builder/query")
     async def query_handler(request: web.Request):
         payload = await request.post()
         try:
-            data = perform_query(**payload)
+            data = await perform_query_async(**payload)
         except Exception as e:
             return web.json_response({"error": type(e).__name__ + ": " + str(e)})
+        # Add whatever was written to the mirror straight away.
+        if payload.get("query_type") == "write_new_quizdle":
+            quizdle = json.loads(payload["quizdle"])
+            mirror.store({quizdle["date"]: parse_quizdle({"quiz": quizdle})})
+        elif payload.get("query_type") == "write_quizdles":
+            quizdles = json.loads(payload["quizdles"])
+            mirror.store({quizdle["date"]: parse_quizdle({"quiz": quizdle})
+                          for quizdle, result in zip(quizdles, data["results"]) if result["success"]})
         return web.json_response({"data": data})
 
     # These need to be in order of depth, starting with deepest?
-    routes.static("/quizdle-builder", "quizdle-builder")
-    routes.static("/", "client")
+    routes.get("/quizdle-builder/{path:.+}")(static_handler("quizdle-builder"))
+    routes.get("/{path:.+}")(static_handler("client"))
 
     app.router.add_routes(routes)
 
@@ -125,7 +607,11 @@ async def run_server(port):
     await site.start()
     print("Server running...")
 
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # (Which runs the app's on_cleanup hooks.)
+        await runner.cleanup()
 
 if __name__ == "__main__":
     print("Starting server...")
@@ -11,7 +11,7 @@ import argparse
 import os
 
 from api_requests import update_dns_record_ip_address, enter_development_mode
-from server import run_server
+from server import run_server, POOL_SIZE, MAX_QUEUE_DEPTH
 
 HOSTNAME = "pi.nicyelland.com"
 DEFAULT_PORT = 12233
@@ -39,6 +39,21 @@ def get_args(arg_list: Optional[Sequence[str]] = None):
         default=DEFAULT_PORT,
         help="port on which to run the server"
     )
+    parser.add_argument(
+        "-w", "--workers",
+        action="store",
+        type=int,
+        default=POOL_SIZE,
+        help="number of worker processes for generating crosswords"
+    )
+    parser.add_argument(
+        "-q", "--max-queue",
+        action="store",
+        type=int,
+        default=MAX_QUEUE_DEPTH,
+        help="number of crossword generation jobs that may wait for a worker before further requests are turned away "
+             "with 503 errors"
+    )
     parser.add_argument(
         "-u", "--update-ip",
         action="store_true",
@@ -60,7 +75,7 @@ async def main():
         print("Updating IP address...")
         await update_dns_record_ip_address(HOSTNAME)
 
-    await run_server(args.port)
+    await run_server(args.port, args.workers, args.max_queue)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+"""
+SUGGESTIONS.PY
+
+Suggests answers to complete a Quizdle: given some of its answers, finds words from a dictionary (a word list file with
+one word per line) that would add the most crossings to the best grids of those answers, and keep them most compact.
+
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import os
+import time
+
+from array import array
+from collections import Counter
+
+from crossword import (Crossword, Word, Search, BadRequest, search_grids, grid_json, TRANSPOSE_SYMMETRY,
+                       FORWARD_CHECKING, TIME_LIMIT, MAX_WORDS, MAX_WORD_LENGTH)
+
+DICTIONARY_PATH = "words.txt"
+MIN_WORD_LENGTH = 3
+MAX_SUGGESTIONS = 20
+# Number of the best grids of the given answers to fit suggestions into...
+SUGGESTION_GRIDS = 3
+# ...and the number of candidate placements to check fully in each grid, most promising first.
+MAX_PLACEMENT_CHECKS = 5000
+
+
+class Dictionary:
+
+    def __init__(self, words: List[str]):
+        """
+        :param words: Words to suggest from. Words with anything other than letters, or of unsuitable lengths, are
+            skipped.
+        """
+        self.words = sorted({word.upper() for word in words
+                             if word.isalpha() and MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH})
+
+        # Index of where each letter occurs: the id (position in self.words) of each word containing it, and the
+        # offset of the letter in that word, as parallel arrays to keep the index compact.
+        self.word_ids: Dict[str, array] = {}
+        self.offsets: Dict[str, array] = {}
+        for word_id, word in enumerate(self.words):
+            for offset, char in enumerate(word):
+                if char not in self.word_ids:
+                    self.word_ids[char] = array("I")
+                    self.offsets[char] = array("B")
+                self.word_ids[char].append(word_id)
+                self.offsets[char].append(offset)
+
+    @classmethod
+    def load(cls, path: str) -> 'Dictionary':
+        with open(path, "r") as f:
+            return cls([line.strip() for line in f])
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+
+# Loaded once, at server startup (see load_dictionary(...)), before the worker processes are started, so that they
+# share it.
+dictionary: Optional[Dictionary] = None
+
+
+def load_dictionary(path: str = DICTIONARY_PATH) -> Optional[Dictionary]:
+    """
+    Loads the dictionary used for suggestions, if the word list file exists.
+    :param path: Path of the word list file.
+    :return: The dictionary, or None if there is no word list.
+    """
+    global dictionary
+    if os.path.exists(path):
+        dictionary = Dictionary.load(path)
+    return dictionary
+
+
+def candidate_placements(crossword: Crossword, words: Dictionary, limit: int) -> List[Tuple[int, Word]]:
+    """
+    Finds every placement of a dictionary word crossing a crossword at a letter it shares, counting how many of the
+    crossword's letters each placement shares (an upper bound on the crossings it would add, since other letters may
+    conflict). Only cells in a single word can be crossed.
+    :param crossword: Valid crossword.
+    :param words: Dictionary to suggest from.
+    :param limit: Number of placements to return.
+    :return: List of (number of shared letters, placed word) for the placements sharing most letters, most first.
+    """
+    crossword.ensure_index()
+    counts: Counter = Counter()
+    for direction, owners in crossword.owners.items():
+        new_direction = Word.DOWN if direction == Word.ACROSS else Word.ACROSS
+        other_owners = crossword.owners[new_direction]
+        for (x, y), word in owners.items():
+            if (x, y) in other_owners:
+                continue
+            char = crossword.letters[x, y]
+            if char not in words.word_ids:
+                continue
+            if new_direction == Word.DOWN:
+                counts.update((word_id, x, y - offset, new_direction)
+                              for word_id, offset in zip(words.word_ids[char], words.offsets[char]))
+            else:
+                counts.update((word_id, x - offset, y, new_direction)
+                              for word_id, offset in zip(words.word_ids[char], words.offsets[char]))
+
+    return [(count, Word(words.words[word_id], x, y, direction))
+            for (word_id, x, y, direction), count in counts.most_common(limit)]
+
+
+def suggest_words(wordlist: List[str]) -> Dict[str, Any]:
+    """
+    Handles a /quizdle-builder/suggest request: suggests words to add to a list of answers, by fitting candidates from
+    the dictionary into the best grids of the answers. Intended to be run in a worker process.
+    :param wordlist: Answers so far (as strings), which must form a connected grid.
+    :return: JSON data, with suggestions ranked by the score of the best grid they make (see Crossword.score()).
+    """
+    if not wordlist or len(wordlist) >= MAX_WORDS:
+        raise BadRequest(f"Give between 1 and {MAX_WORDS - 1} answers to get suggestions!")
+    if any(len(word) > MAX_WORD_LENGTH for word in wordlist):
+        raise BadRequest(f"Words too long! (max length {MAX_WORD_LENGTH})")
+
+    json_data = {"errors": [], "suggestions": []}
+    words = dictionary or load_dictionary()
+    if words is None:
+        json_data["errors"].append("no_dictionary")
+        return json_data
+
+    search = Search(TRANSPOSE_SYMMETRY, deadline=time.monotonic() + TIME_LIMIT, forward_checking=FORWARD_CHECKING)
+    result = search_grids(wordlist, "best", search=search)
+    if not result.grids:
+        json_data["errors"].append("no_grids_found")
+        if result.infeasible is not None:
+            json_data["message"] = result.infeasible
+        return json_data
+
+    # Best grid (and its score) found for each candidate word.
+    best: Dict[str, Tuple[Tuple[int, int, float], Crossword]] = {}
+    used = set(wordlist)
+    for grid in result.grids[:SUGGESTION_GRIDS]:
+        for _, new_word in candidate_placements(grid, words, MAX_PLACEMENT_CHECKS):
+            if new_word.word in used or not grid.is_valid_with(new_word):
+                continue
+            new_grid = grid.add_word(new_word)
+            new_grid.align()
+            score = new_grid.score()
+            if new_word.word not in best or score < best[new_word.word][0]:
+                best[new_word.word] = score, new_grid
+
+    ranked = sorted(best.items(), key=lambda item: item[1][0])[:MAX_SUGGESTIONS]
+    for word, (score, grid) in ranked:
+        json_data["suggestions"].append({
+            "word": word,
+            "crossings": -score[0],
+            "grid": grid_json(grid)
+        })
+    return json_data